@@ -15,6 +15,66 @@ API_SECRET = str(os.getenv("API_SECRET"))
 CHANNEL_IDtwiter = os.getenv("CHANNEL_IDtwiter")
 OUTPUT_DIR = "downloads"
 
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 1))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+FILE_ID_CACHE_SIZE = int(os.getenv("FILE_ID_CACHE_SIZE", 10_000))
+FILE_ID_CACHE_TTL = int(os.getenv("FILE_ID_CACHE_TTL", 24 * 60 * 60))
+STATUS_CACHE_SIZE = int(os.getenv("STATUS_CACHE_SIZE", 100_000))
+STATUS_CACHE_TTL = int(os.getenv("STATUS_CACHE_TTL", 60))
+BANNED_IDS_REFRESH = int(os.getenv("BANNED_IDS_REFRESH", 5 * 60))
+
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", 100))
+HTTP_PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", 8))
+HTTP_TIMEOUT = int(os.getenv("HTTP_TIMEOUT", 600))
+HTTP_CONNECT_TIMEOUT = int(os.getenv("HTTP_CONNECT_TIMEOUT", 15))
+HTTP_READ_TIMEOUT = int(os.getenv("HTTP_READ_TIMEOUT", 60))
+HTTP_CHUNK_SIZE = int(os.getenv("HTTP_CHUNK_SIZE", 64 * 1024))
+
+DOWNLOAD_LIMITS = {
+    'tiktok': int(os.getenv("TIKTOK_WORKERS", 4)),
+    'youtube': int(os.getenv("YOUTUBE_WORKERS", 2)),
+    'instagram': int(os.getenv("INSTAGRAM_WORKERS", 2)),
+    'twitter': int(os.getenv("TWITTER_WORKERS", 4)),
+}
+DOWNLOAD_GLOBAL_LIMIT = int(os.getenv("DOWNLOAD_GLOBAL_LIMIT", 8))
+DOWNLOAD_QUEUE_LIMIT = int(os.getenv("DOWNLOAD_QUEUE_LIMIT", 50))
+MEDIA_FETCH_WORKERS = int(os.getenv("MEDIA_FETCH_WORKERS", 6))
+MEDIA_FETCH_RETRIES = int(os.getenv("MEDIA_FETCH_RETRIES", 3))
+
+ALBUM_SIZE = int(os.getenv("ALBUM_SIZE", 10))
+ALBUM_MAX_WAIT = int(os.getenv("ALBUM_MAX_WAIT", 10))
+TWITTER_CHAT_WORKERS = int(os.getenv("TWITTER_CHAT_WORKERS", 16))
+
+# Telegram Bot API limits: ~30 messages/s overall, 1/s per private chat, 20/min per group
+TELEGRAM_GLOBAL_RATE = int(os.getenv("TELEGRAM_GLOBAL_RATE", 30))
+TELEGRAM_CHAT_RATE = int(os.getenv("TELEGRAM_CHAT_RATE", 1))
+TELEGRAM_GROUP_RATE = int(os.getenv("TELEGRAM_GROUP_RATE", 20))
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", 3))
+
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 25))
+BROADCAST_BATCH_SIZE = int(os.getenv("BROADCAST_BATCH_SIZE", 500))
+BROADCAST_PROGRESS_INTERVAL = int(os.getenv("BROADCAST_PROGRESS_INTERVAL", 15))
+
+SHORT_LINK_TTL = int(os.getenv("SHORT_LINK_TTL", 30 * 24 * 60 * 60))
+SHORT_LINK_CACHE_SIZE = int(os.getenv("SHORT_LINK_CACHE_SIZE", 10_000))
+
+BOT_INFO_TTL = int(os.getenv("BOT_INFO_TTL", 60 * 60))
+
+TWEET_CACHE_TTL = int(os.getenv("TWEET_CACHE_TTL", 24 * 60 * 60))
+TWEET_CACHE_SIZE = int(os.getenv("TWEET_CACHE_SIZE", 10_000))
+
+INSTAGRAM_POOL_SIZE = int(os.getenv("INSTAGRAM_POOL_SIZE", DOWNLOAD_LIMITS['instagram']))
+INSTAGRAM_SESSION_CHECK = int(os.getenv("INSTAGRAM_SESSION_CHECK", 30 * 60))
+INSTAGRAM_FETCH_TIMEOUT = int(os.getenv("INSTAGRAM_FETCH_TIMEOUT", 60))
+
+YOUTUBE_TOKEN_FILE = os.getenv("YOUTUBE_TOKEN_FILE", "youtube_tokens.json")
+YOUTUBE_TOKEN_REFRESH = int(os.getenv("YOUTUBE_TOKEN_REFRESH", 30 * 60))
+YOUTUBE_CACHE_SIZE = int(os.getenv("YOUTUBE_CACHE_SIZE", 1000))
+YOUTUBE_CACHE_TTL = int(os.getenv("YOUTUBE_CACHE_TTL", 60 * 60))
+# Largest file the bot can upload: 50 MB through the cloud Bot API; set it to 2000 MB only when the bot
+# talks to a local Bot API server
+TELEGRAM_UPLOAD_LIMIT = int(os.getenv("TELEGRAM_UPLOAD_LIMIT", 50 * 1000 * 1000))
+
 BOT_COMMANDS = [
     {'command': 'start', 'description': '🚀Початок роботи / Get started🔥'},
     {'command': 'settings', 'description': '⚙️Налаштування / Settings🛠'},
@@ -5,7 +5,8 @@ import tempfile
 from collections import defaultdict
 from pyrogram import Client, filters, enums
 from pyrogram.types import InputMediaVideo
-from moviepy.editor import VideoFileClip
+
+from services.media_probe import probe_media
 
 # ---------- استخراج معرف القناة من متغيرات البيئة ----------
 raw_channel_id = os.getenv("CHANNEL_ID")
@@ -83,7 +84,7 @@ async def process_video(chat_id, message):
     """
     معالجة فيديو واحد:
     - تنزيل الملف، إصلاحه باستخدام ffmpeg،
-    - استخراج البيانات باستخدام MoviePy وإنشاء صورة مصغرة.
+    - استخراج البيانات من ترويسة الملف وإنشاء صورة مصغرة.
     تُعيد الدالة قاموسًا يحتوي على بيانات الفيديو المعالج.
     بعد الانتهاء يتم حذف رسالة المستخدم ورسالة التأكيد فوراً.
     """
@@ -116,13 +117,13 @@ async def process_video(chat_id, message):
             os.remove(temp_file)
             temp_file = fixed_file
 
-        # استخراج بيانات الفيديو باستخدام MoviePy
-        with VideoFileClip(temp_file, audio=False) as clip:
-            metadata = {
-                'duration': int(clip.duration),
-                'width': clip.size[0],
-                'height': clip.size[1]
-            }
+        # استخراج بيانات الفيديو من ترويسة الملف دون فك ترميز الإطارات
+        video_info = await probe_media(temp_file)
+        metadata = {
+            'duration': int((video_info.duration_ms or 0) / 1000),
+            'width': video_info.width,
+            'height': video_info.height
+        }
         # إنشاء الصورة المصغرة
         thumb = await handle_errors(generate_thumbnail, temp_file)
 
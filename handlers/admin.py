@@ -6,7 +6,7 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 
-from main import bot, db
+from main import bot, broadcaster, db
 from filters import IsBotAdmin
 import keyboards as kb
 import messages as bm
@@ -74,34 +74,13 @@ async def send_to_all_message(message: types.Message, state: FSMContext):
                                text=bm.start_mailing(),
                                reply_markup=types.ReplyKeyboardRemove())
 
-        users = await db.all_users()
-        for user in users:
-            try:
-                await bot.forward_message(chat_id=user[0],
-                                          from_chat_id=sender_id,
-                                          message_id=message.message_id)
-
-                user_status = await db.status(user[0])
-
-                if user_status == "inactive":
-                    await db.set_active(user[0])
-
-                await asyncio.sleep(
-                    0.05
-                )
-
-            except Exception as e:
-
-                if str(e) == "Forbidden: bots can't send messages to bots":
-                    await db.delete_user(user[0])
-
-                if "blocked" or "Chat not found" in str(e):
-                    await db.set_inactive(user[0])
-                continue
-
-        await bot.send_message(chat_id=message.chat.id,
-                               text=bm.finish_mailing(),
-                               reply_markup=types.ReplyKeyboardRemove())
+        # Runs in the background; progress and the final stats are reported to this chat
+        try:
+            await broadcaster.start(admin_chat_id=message.chat.id, from_chat_id=sender_id,
+                                    message_id=message.message_id)
+        except Exception as e:
+            print(e)
+            await message.answer(bm.something_went_wrong())
         return
 
 
@@ -1,22 +1,25 @@
 import asyncio
 import os
 import re
+from contextlib import aclosing
 
 import instaloader
 from aiogram import Router, F, types
 from aiogram.types import FSInputFile
 from aiogram.utils.media_group import MediaGroupBuilder
-from moviepy import VideoFileClip
 
 import messages as bm
 from config import OUTPUT_DIR, INST_PASS, INST_LOGIN, admin_id
 from handlers.user import update_info
-from main import bot, db, send_analytics
+from main import bot, bot_context, db, http, inflight, scheduler, send_analytics
+from services.instagram_session import InstagramSessionManager
+from services.media_pipeline import fetch_in_chunks
+from services.media_probe import probe_media
+from services.scheduler import QueueFullError
+from services.url_normalizer import canonical_url, extract_content_id
 
 router = Router()
 
-L = instaloader.Instaloader()
-
 
 # Асинхронне очікування коду двофакторної автентифікації
 async def wait_for_code(admin_id):
@@ -34,37 +37,45 @@ async def wait_for_code(admin_id):
     return await code_future
 
 
-# Асинхронна обробка авторизації Instaloader з двофакторною автентифікацією
-async def instaloader_login(L, login, password, admin_id):
-    try:
-        # Спробувати завантажити сесію
-        await asyncio.to_thread(L.load_session_from_file, login)
-        print("Login with Session")
-    except Exception as e:
-        print(e)
-        try:
-            await asyncio.to_thread(L.close)
-            await asyncio.to_thread(L.login, login, password)
-            await asyncio.to_thread(L.save_session_to_file)
-            print("Login Successful")
-        except instaloader.exceptions.TwoFactorAuthRequiredException:
-            # Отримуємо код 2FA від адміністратора
-            code = str(await wait_for_code(admin_id))
-            # Виконуємо двофакторний логін з кодом
-            await asyncio.to_thread(L.two_factor_login, code)
-            await asyncio.to_thread(L.save_session_to_file)
+# Сесія завантажується один раз і ділиться між пулом екземплярів Instaloader
+sessions = InstagramSessionManager(INST_LOGIN, INST_PASS, lambda: wait_for_code(admin_id))
+
+
+def fetch_post(context, shortcode):
+    """Load a post and list (url, is_video) for each of its items; runs in the Instagram worker pool."""
+    post = instaloader.Post.from_shortcode(context, shortcode)
+    if post.typename == "GraphSidecar":
+        media = [(node.video_url if node.is_video else node.display_url, node.is_video)
+                 for node in post.get_sidecar_nodes()]
+    else:
+        media = [(post.video_url if post.is_video else post.url, post.is_video)]
+    return post, post.caption, media
+
+
+def download_post_media(media, download_dir, chunk_size=10, slot=None):
+    """Download the items of a post concurrently; yields [(file_path, is_video)] chunks in post order.
+
+    slot is held only while the items are downloading.
+    """
+    os.makedirs(download_dir, exist_ok=True)
+
+    async def fetch(item):
+        idx, (media_url, is_video) = item
+        file_path = os.path.join(download_dir, f"{idx}.mp4" if is_video else f"{idx}.jpg")
+        await http.download(media_url, file_path)
+        return file_path, is_video
+
+    return fetch_in_chunks(list(enumerate(media)), fetch, chunk_size, slot=slot)
 
 
 @router.message(F.text.regexp(r"(https?://(www\.)?instagram\.com/\S+)"))
 @router.business_message(F.text.regexp(r"(https?://(www\.)?instagram\.com/\S+)"))
 async def process_url_instagram(message: types.Message):
-    await instaloader_login(L, INST_LOGIN, INST_PASS, admin_id)
-
     business_id = message.business_connection_id
 
     await send_analytics(user_id=message.from_user.id, chat_type=message.chat.type, action_name="instagram")
 
-    bot_url = f"t.me/{(await bot.get_me()).username}"
+    bot_url = await bot_context.bot_url()
 
     url_match = re.match(r"(https?://(www\.)?instagram\.com/\S+)", message.text)
     if url_match:
@@ -78,17 +89,16 @@ async def process_url_instagram(message: types.Message):
 
     # Get the Instagram post from URL
     try:
-        post = instaloader.Post.from_shortcode(L.context, url.split("/")[-2])
+        shortcode = extract_content_id("instagram", url) or url.split("/")[-2]
+        async with sessions.acquire() as L:
+            post, post_caption, media = await sessions.run(L, fetch_post, L.context, shortcode)
         user_captions = await db.get_user_captions(message.from_user.id)
         download_dir = f"{OUTPUT_DIR}.{post.shortcode}"
 
-        post_caption = post.caption
-
-        reels_url = f"https://www.instagram.com/reel/"
-
-        print(reels_url)
+        # /p/, /reel/ and /tv/ links of the same post share one cache key
+        cache_key = canonical_url("instagram", url) or f"https://www.instagram.com/reel/{post.shortcode}"
 
-        db_file_id = await db.get_file_id(reels_url+post.shortcode)
+        db_file_id = await db.get_file_id(cache_key)
 
         if db_file_id:
             await bot.send_chat_action(message.chat.id, "upload_video")
@@ -98,54 +108,69 @@ async def process_url_instagram(message: types.Message):
                                        parse_mode="HTML")
             return
 
-        L.download_post(post, target=download_dir)
-
         if "/reel/" in url:
             file_type = "video"
+            videos = [item for item in media if item[1]][:1]
+
+            async def download_and_send():
+                files = []
+                async with aclosing(download_post_media(videos, download_dir,
+                                                        slot=scheduler.slot("instagram", message))) as chunks:
+                    async for chunk in chunks:
+                        files.extend(chunk)
+
+                if not files:
+                    raise Exception(f"No video downloaded for {post.shortcode}")
 
-            for root, _, files in os.walk(download_dir):
-                for file in files:
-                    if file.endswith('.mp4'):
-                        file_path = os.path.join(root, file)
+                for file_path, _ in files:
+                    video_info = await probe_media(file_path)
+                    width, height = video_info.width, video_info.height
 
-                        video_clip = VideoFileClip(file_path)
-                        width, height = video_clip.size
+                    if business_id is None:
+                        await bot.send_chat_action(message.chat.id, "upload_video")
 
-                        if business_id is None:
-                            await bot.send_chat_action(message.chat.id, "upload_video")
+                    sent_message = await message.answer_video(video=FSInputFile(file_path),
+                                                              caption=bm.captions(user_captions, post_caption,
+                                                                                  bot_url),
+                                                              width=width, height=height,
+                                                              parse_mode="HTML")
 
-                        sent_message = await message.answer_video(video=FSInputFile(file_path),
-                                                                  caption=bm.captions(user_captions, post_caption,
-                                                                                      bot_url),
-                                                                  width=width, height=height,
-                                                                  parse_mode="HTML")
+                    file_id = sent_message.video.file_id
 
-                        file_id = sent_message.video.file_id
+                    await db.add_file(url=cache_key, file_id=file_id, file_type=file_type)
+                    return file_id
 
-                        await db.add_file(url=reels_url + post.shortcode, file_id=file_id, file_type=file_type)
-                        break
+            # The same reel requested concurrently is downloaded once; the others reuse its file_id
+            file_id, shared = await inflight.do(cache_key, download_and_send)
+
+            if shared:
+                if file_id is None:
+                    raise Exception(f"Shared download of {post.shortcode} produced no video")
+
+                await bot.send_chat_action(message.chat.id, "upload_video")
+
+                await message.answer_video(video=file_id,
+                                           caption=bm.captions(user_captions, post_caption, bot_url),
+                                           parse_mode="HTML")
+                return
         else:
-            # Send all media if the URL is not for a reel
-            media_group = MediaGroupBuilder(caption=bm.captions(user_captions, post_caption, bot_url))
-
-            batch_size = 10
-            batch = 0
-            for root, _, files in os.walk(download_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    if file.endswith(('.jpg', '.jpeg', '.png')):
-                        media_group.add_photo(media=FSInputFile(file_path), parse_mode="HTML")
-                        batch += 1
-                    elif file.endswith('.mp4'):
-                        media_group.add_video(media=FSInputFile(file_path), parse_mode="HTML")
-                        batch += 1
-
-                    if batch == batch_size:
-                        await message.answer_media_group(media=media_group.build())
-                        media_group = MediaGroupBuilder(caption=bm.captions(user_captions, post_caption, bot_url))
-
-            if batch > 0:
-                await message.answer_media_group(media=media_group.build())
+            # Send all media if the URL is not for a reel, each album as soon as its 10 items are in
+            sent = 0
+            async with aclosing(download_post_media(media, download_dir,
+                                                    slot=scheduler.slot("instagram", message))) as chunks:
+                async for files in chunks:
+                    media_group = MediaGroupBuilder(caption=bm.captions(user_captions, post_caption, bot_url))
+                    for file_path, is_video in files:
+                        if is_video:
+                            media_group.add_video(media=FSInputFile(file_path), parse_mode="HTML")
+                        else:
+                            media_group.add_photo(media=FSInputFile(file_path), parse_mode="HTML")
+
+                    await message.answer_media_group(media=media_group.build())
+                    sent += len(files)
+
+            if not sent:
+                raise Exception(f"No media downloaded for {post.shortcode}")
 
         await asyncio.sleep(5)
 
@@ -155,6 +180,10 @@ async def process_url_instagram(message: types.Message):
                 os.remove(os.path.join(root, file))
             os.rmdir(download_dir)
 
+    except QueueFullError as e:
+        print(e)
+        await message.reply(bm.queue_full())
+
     except Exception as e:
         print(e)
         if business_id is None:
@@ -2,21 +2,24 @@ import asyncio
 import datetime
 import os
 import re
-import time
+from contextlib import aclosing
 
-import requests
 from aiogram import types, Router, F
 from aiogram.types import FSInputFile
 from aiogram.utils.media_group import MediaGroupBuilder
 from bs4 import BeautifulSoup
-from moviepy import VideoFileClip, AudioFileClip
 
 import keyboards as kb
 import messages as bm
 from config import OUTPUT_DIR
 from handlers.user import update_info
 from helper import expand_tiktok_url
-from main import bot, db, send_analytics
+from main import bot, bot_context, db, http, inflight, scheduler, send_analytics
+from services.http_client import FileTooLargeError
+from services.media_pipeline import fetch_in_chunks
+from services.media_probe import probe_media
+from services.scheduler import QueueFullError
+from services.url_normalizer import canonical_url, extract_content_id
 
 MAX_FILE_SIZE = 500 * 1024 * 1024
 
@@ -24,72 +27,133 @@ router = Router()
 
 
 class DownloaderTikTok:
-    def __init__(self, output_dir, filename):
+    def __init__(self, output_dir, filename, max_size=MAX_FILE_SIZE):
         self.output_dir = output_dir
         self.filename = filename
+        self.max_size = max_size
 
-    def download_video(self, video_id):
+    async def download_video(self, video_id):
         try:
             download_url = f"https://tikwm.com/video/media/play/{video_id}.mp4"
-            response = requests.get(download_url, allow_redirects=True)
-            if response.status_code == 200:
-                with open(self.filename, 'wb') as f:
-                    f.write(response.content)
-                return True
-            return False
+            await http.download(download_url, self.filename, max_size=self.max_size)
+            return True
+        except FileTooLargeError:
+            raise
         except Exception as e:
             print(f"Error: {e}")
             return False
 
-    def download_audio(self, video_id):
+    async def download_audio(self, video_id):
         try:
             download_url = f"https://tikwm.com/video/music/{video_id}.mp3"
-            response = requests.get(download_url, allow_redirects=True)
-            if response.status_code == 200:
-                with open(self.filename, 'wb') as f:
-                    f.write(response.content)
-                return True
-            return False
-        except Exception as e:
-            print(f"Error: {e}")
-            return False
-
-    def download_photos(self, photo_id):
-        try:
-            url = f"https://tikwm.com/video/{photo_id}.html"
-            response = requests.get(url, allow_redirects=True)
-            time.sleep(1)
-            soup = BeautifulSoup(response.content, 'html.parser')
-            photo_links = []
-            for div in soup.find_all("div", class_=["col-lg-2", "col-md-3", "col-sm-4", "col-xs-4"]):
-                a_tag = div.find("a")
-                if a_tag and 'href' in a_tag.attrs:
-                    photo_links.append(a_tag['href'])
-
-            download_dir = os.path.join(self.output_dir, photo_id)
-            os.makedirs(download_dir, exist_ok=True)
-
-            for idx, photo_url in enumerate(photo_links):
-                try:
-                    photo_response = requests.get(photo_url)
-                    if photo_response.status_code == 200:
-                        photo_path = os.path.join(download_dir, f"{idx}.jpg")
-                        with open(photo_path, 'wb') as f:
-                            f.write(photo_response.content)
-                except:
-                    pass
+            await http.download(download_url, self.filename, max_size=self.max_size)
             return True
+        except FileTooLargeError:
+            raise
         except Exception as e:
             print(f"Error: {e}")
             return False
 
+    async def photo_links(self, photo_id):
+        url = f"https://tikwm.com/video/{photo_id}.html"
+        html = await http.get_text(url)
+        soup = BeautifulSoup(html, 'html.parser')
+        photo_links = []
+        for div in soup.find_all("div", class_=["col-lg-2", "col-md-3", "col-sm-4", "col-xs-4"]):
+            a_tag = div.find("a")
+            if a_tag and 'href' in a_tag.attrs:
+                photo_links.append(a_tag['href'])
+        return photo_links
+
+    async def download_photos(self, photo_id, chunk_size=10, slot=None):
+        """Yield lists of downloaded photo paths in slideshow order, chunk_size at a time.
+
+        Photos are fetched concurrently, so the first chunk can be sent while the rest are still
+        downloading. Photos that fail every retry are skipped. slot is held only while downloading.
+        """
+        photo_links = await self.photo_links(photo_id)
+
+        download_dir = os.path.join(self.output_dir, photo_id)
+        os.makedirs(download_dir, exist_ok=True)
+
+        async def fetch(item):
+            idx, photo_url = item
+            return await http.download(photo_url, os.path.join(download_dir, f"{idx}.jpg"), max_size=self.max_size)
+
+        async with aclosing(fetch_in_chunks(list(enumerate(photo_links)), fetch, chunk_size, slot=slot)) as chunks:
+            async for photo_paths in chunks:
+                yield photo_paths
+
+
+async def answer_cached_video(message: types.Message, file_id, video_id, bot_url):
+    business_id = message.business_connection_id
+
+    if business_id is None:
+        await bot.send_chat_action(message.chat.id, "upload_video")
+
+    await message.answer_video(video=file_id,
+                               caption=bm.captions(None, None, bot_url),
+                               reply_markup=kb.return_audio_download_keyboard("tt",
+                                                                              video_id) if business_id is None else None,
+                               parse_mode="HTML")
+
+
+async def download_and_send_video(message: types.Message, cache_key, video_id, video_file_path, bot_url):
+    """Download a TikTok video, upload it to the chat and store its file_id; returns the file_id or None."""
+    business_id = message.business_connection_id
+    downloader = DownloaderTikTok(OUTPUT_DIR, video_file_path)
+
+    try:
+        async with scheduler.slot("tiktok", message):
+            downloaded = await downloader.download_video(video_id)
+    except FileTooLargeError as e:
+        print(e)
+        if business_id is None:
+            react = types.ReactionTypeEmoji(emoji="👎")
+            await message.react([react])
+        await message.reply("The video is too large.")
+        return None
+    except QueueFullError as e:
+        print(e)
+        await message.reply(bm.queue_full())
+        return None
+
+    if not downloaded:
+        if business_id is None:
+            react = types.ReactionTypeEmoji(emoji="👎")
+            await message.react([react])
+        await message.reply("Something went wrong :(\nPlease try again later.")
+        return None
+
+    video = FSInputFile(video_file_path)
+
+    video_info = await probe_media(video_file_path)
+    width, height = video_info.width, video_info.height
+
+    if business_id is None:
+        await bot.send_chat_action(message.chat.id, "upload_video")
+
+    sent_message = await message.reply_video(
+        video=video,
+        width=width,
+        height=height,
+        caption=bm.captions(None, None, bot_url),
+        reply_markup=kb.return_audio_download_keyboard("tt", video_id) if business_id is None else None,
+        parse_mode="HTML"
+    )
+
+    file_id = sent_message.video.file_id
+
+    await db.add_file(cache_key, file_id, "video")
+    return file_id
+
 
 @router.message(F.text.regexp(r"(https?://(www\.|vm\.|vt\.|vn\.)?tiktok\.com/\S+)"))
 @router.business_message(F.text.regexp(r"(https?://(www\.|vm\.|vt\.|vn\.)?tiktok\.com/\S+)"))
 async def process_url_tiktok(message: types.Message):
     business_id = message.business_connection_id
 
-    bot_url = f"t.me/{(await bot.get_me()).username}"
+    bot_url = await bot_context.bot_url()
 
     url_match = re.match(r"(https?://(www\.|vm\.|vt\.|vn\.)?tiktok\.com/\S+)", message.text)
     if url_match:
@@ -97,7 +161,8 @@ async def process_url_tiktok(message: types.Message):
     else:
         url = message.text
 
-    full_url = expand_tiktok_url(url)
+    full_url = await expand_tiktok_url(url)
+    cache_key = canonical_url("tiktok", full_url) or full_url
 
     if business_id is None:
         react = types.ReactionTypeEmoji(emoji="👨‍💻")
@@ -107,106 +172,78 @@ async def process_url_tiktok(message: types.Message):
 
         await send_analytics(user_id=message.from_user.id, chat_type=message.chat.type, action_name="tiktok_video")
 
-        file_type = "video"
         time = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        video_id = full_url.split('/')[-1].split('?')[0]
+        video_id = extract_content_id("tiktok", full_url) or full_url.split('/')[-1].split('?')[0]
         name = f"{time}_tiktok_video.mp4"
 
-        db_file_id = await db.get_file_id(full_url)
+        db_file_id = await db.get_file_id(cache_key)
 
         if db_file_id:
-            if business_id is None:
-                await bot.send_chat_action(message.chat.id, "upload_video")
-
-            await message.answer_video(video=db_file_id[0][0],
-                                       caption=bm.captions(None, None, bot_url),
-                                       reply_markup=kb.return_audio_download_keyboard("tt",
-                                                                                      video_id) if business_id is None else None,
-                                       parse_mode="HTMl")
+            await answer_cached_video(message, db_file_id[0][0], video_id, bot_url)
             return
 
         video_file_path = os.path.join(OUTPUT_DIR, name)
-        downloader = DownloaderTikTok(OUTPUT_DIR, video_file_path)
 
-        if downloader.download_video(video_id):
-            video = FSInputFile(video_file_path)
-            file_size = os.path.getsize(video_file_path)
-
-            video_clip = VideoFileClip(video_file_path)
-            width, height = video_clip.size
-
-            if file_size < MAX_FILE_SIZE:
-                if business_id is None:
-                    await bot.send_chat_action(message.chat.id, "upload_video")
-
-                sent_message = await message.reply_video(
-                    video=video,
-                    width=width,
-                    height=height,
-                    caption=bm.captions(None, None, bot_url),
-                    reply_markup=kb.return_audio_download_keyboard("tt", video_id) if business_id is None else None,
-                    parse_mode="HTML"
-                )
-
-                file_id = sent_message.video.file_id
-
-                await db.add_file(full_url, file_id, file_type)
+        # Users posting the same link at once share one download/upload and reuse its file_id
+        file_id, shared = await inflight.do(
+            cache_key, lambda: download_and_send_video(message, cache_key, video_id, video_file_path, bot_url))
 
+        if shared:
+            if file_id:
+                await answer_cached_video(message, file_id, video_id, bot_url)
             else:
                 if business_id is None:
                     react = types.ReactionTypeEmoji(emoji="👎")
                     await message.react([react])
-                await message.reply("The video is too large.")
-
+                await message.reply("Something went wrong :(\nPlease try again later.")
+        elif os.path.exists(video_file_path):
             await asyncio.sleep(5)
             os.remove(video_file_path)
-        else:
-            if business_id is None:
-                react = types.ReactionTypeEmoji(emoji="👎")
-                await message.react([react])
-            await message.reply("Something went wrong :(\nPlease try again later.")
 
 
     elif "photo" in full_url:
         await send_analytics(user_id=message.from_user.id, chat_type=message.chat.type, action_name="tiktok_photos")
 
-        photo_id = full_url.split('/')[-1].split('?')[0]
+        photo_id = extract_content_id("tiktok", full_url) or full_url.split('/')[-1].split('?')[0]
         downloader = DownloaderTikTok(OUTPUT_DIR, "")
-        download_dir = os.path.join("downloads", photo_id)
-
-        if downloader.download_photos(photo_id):
-            all_files = []
-            for root, dirs, files in os.walk(download_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    if file.endswith(('.jpg', '.jpeg', '.png')):
-                        all_files.append(file_path)
-
-            all_files.sort(key=lambda x: int(os.path.basename(x).split('.')[0]))
-
-            if business_id is None:
-                await bot.send_chat_action(message.chat.id, "upload_photo")
-
-            while all_files:
-                media_group = MediaGroupBuilder(caption=bm.captions(None, None, bot_url))
-                for _ in range(min(10, len(all_files))):
-                    file_path = all_files.pop(0)
-                    media_group.add_photo(media=FSInputFile(file_path), parse_mode="HTML")
+        download_dir = os.path.join(OUTPUT_DIR, photo_id)
 
-                await message.answer_media_group(media=media_group.build())
-
-            await asyncio.sleep(5)
+        sent = 0
+        try:
+            # Each album goes out as soon as its 10 photos are in, while the next ones keep downloading;
+            # the download slot is released when the last photo is in, not when the last album is sent
+            slot = scheduler.slot("tiktok", message)
+            async with aclosing(downloader.download_photos(photo_id, slot=slot)) as albums:
+                async for photo_paths in albums:
+                    if business_id is None:
+                        await bot.send_chat_action(message.chat.id, "upload_photo")
+
+                    media_group = MediaGroupBuilder(caption=bm.captions(None, None, bot_url))
+                    for file_path in photo_paths:
+                        media_group.add_photo(media=FSInputFile(file_path), parse_mode="HTML")
+
+                    await message.answer_media_group(media=media_group.build())
+                    sent += len(photo_paths)
+        except QueueFullError as e:
+            print(e)
+            await message.reply(bm.queue_full())
+            return
+        except Exception as e:
+            print(f"Error: {e}")
 
-            for root, dirs, files in os.walk(download_dir):
-                for file in files:
-                    os.remove(os.path.join(root, file))
-                os.rmdir(download_dir)
-        else:
+        if not sent:
             if business_id is None:
                 react = types.ReactionTypeEmoji(emoji="👎")
                 await message.react([react])
             await message.reply("Something went wrong :(\nPlease try again later.")
 
+        await asyncio.sleep(5)
+
+        for root, dirs, files in os.walk(download_dir):
+            for file in files:
+                os.remove(os.path.join(root, file))
+            os.rmdir(download_dir)
+
     else:
         if business_id is None:
             react = types.ReactionTypeEmoji(emoji="👎")
@@ -219,7 +256,7 @@ async def process_url_tiktok(message: types.Message):
 @router.callback_query(F.data.startswith('tt_audio_'))
 async def download_audio(call: types.CallbackQuery):
     await bot.send_chat_action(call.message.chat.id, "upload_voice")
-    bot_url = f"t.me/{(await bot.get_me()).username}"
+    bot_url = await bot_context.bot_url()
 
     audio_id = call.data.split('_')[2]
 
@@ -229,16 +266,21 @@ async def download_audio(call: types.CallbackQuery):
     audio_file_path = os.path.join(OUTPUT_DIR, name)
     downloader = DownloaderTikTok(OUTPUT_DIR, audio_file_path)
 
-    if downloader.download_video(audio_id):
-        audio = AudioFileClip(audio_file_path)
-        duration = round(audio.duration)
-        file_size = os.path.getsize(audio_file_path)
-
-        if file_size > MAX_FILE_SIZE:
-            os.remove(audio_file_path)
-            await call.message.reply("The audio file is too large.")
-            os.remove(audio_file_path)
-            return
+    try:
+        async with scheduler.slot("tiktok", call.message):
+            downloaded = await downloader.download_video(audio_id)
+    except FileTooLargeError as e:
+        print(e)
+        await call.message.reply("The audio file is too large.")
+        return
+    except QueueFullError as e:
+        print(e)
+        await call.answer(bm.queue_full(), show_alert=True)
+        return
+
+    if downloaded:
+        audio_info = await probe_media(audio_file_path)
+        duration = audio_info.duration
 
         await call.answer()
 
@@ -1,36 +1,36 @@
 import asyncio
 import html
+import json
 import os
 import re
+from contextlib import aclosing
+from typing import NamedTuple, Optional
 from urllib.parse import urlsplit
-import requests
 from aiogram import types, Router, F
 from aiogram.types import FSInputFile
 from aiogram.utils.media_group import MediaGroupBuilder
 from aiogram.exceptions import TelegramAPIError
-from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
 import messages as bm
 from config import OUTPUT_DIR, CHANNEL_IDtwiter
-from main import bot, db, send_analytics
+from main import bot, bot_context, db, http, resolver, scheduler, send_analytics
+from services.keyed_pool import KeyedWorkerPool
+from services.media_batcher import MediaBatcher
+from services.media_pipeline import fetch_in_chunks
+from services.scheduler import QueueFullError
+from services.tweet_cache import TweetCache
+from services.url_normalizer import canonical_url
 
 MAX_FILE_SIZE = 500 * 1024 * 1024
 router = Router()
 
-# لكل chat_id، نخزن وسائط الصور والفيديوهات بشكل منفصل داخل قاموس
-album_accumulator = {}  # الصيغة: { chat_id: {"image": [(file_path, type, dir), ...], "video": [...] } }
-chat_queues = {}        # قاموس لحفظ قوائم الانتظار لكل دردشة
-chat_workers = {}       # قاموس لحفظ مهام المعالجة لكل دردشة
 
 
-def extract_tweet_ids(text):
+async def extract_tweet_ids(text):
     """Extract tweet IDs from message text."""
-    unshortened_links = ''
-    for link in re.findall(r't\.co\/[a-zA-Z0-9]+', text):
-        try:
-            unshortened_link = requests.get('https://' + link).url
-            unshortened_links += '\n' + unshortened_link
-        except:
-            pass
+    links = re.findall(r't\.co\/[a-zA-Z0-9]+', text)
+    unshortened = await asyncio.gather(*(resolver.resolve('https://' + link, method="GET") for link in links),
+                                       return_exceptions=True)
+    unshortened_links = ''.join('\n' + link for link in unshortened if isinstance(link, str))
     tweet_ids = re.findall(
         r"(?:twitter|x)\.com/.{1,15}/(?:web|status(?:es)?)/([0-9]{1,20})",
         text + unshortened_links,
@@ -38,108 +38,145 @@ def extract_tweet_ids(text):
     return list(dict.fromkeys(tweet_ids)) if tweet_ids else None
 
 
-def scrape_media(tweet_id):
-    r = requests.get(f'https://api.vxtwitter.com/Twitter/status/{tweet_id}')
-    r.raise_for_status()
+async def scrape_media(tweet_id):
+    text = await http.get_text(f'https://api.vxtwitter.com/Twitter/status/{tweet_id}')
     try:
-        return r.json()
-    except requests.exceptions.JSONDecodeError:
-        if match := re.search(r'<meta content="(.*?)" property="og:description" />', r.text):
+        return json.loads(text)
+    except json.JSONDecodeError:
+        if match := re.search(r'<meta content="(.*?)" property="og:description" />', text):
             raise Exception(f'API returned error: {html.unescape(match.group(1))}')
         raise
 
 
+# بيانات التغريدات المجلوبة، محفوظة في الذاكرة وفي جدول tweets لمدة TWEET_CACHE_TTL
+tweet_cache = TweetCache(db, scrape_media)
+
+
 async def download_media(media_url, file_path):
-    response = requests.get(media_url, stream=True)
-    response.raise_for_status()
-    with open(file_path, 'wb') as file:
-        for chunk in response.iter_content(chunk_size=8192):
-            file.write(chunk)
-
-
-async def reply_media(message, tweet_id, tweet_media, bot_url, business_id):
-    """معالجة الوسائط مع استخدام قائمة الانتظار وتخزين الصور والفيديوهات منفصلين"""
-    await send_analytics(user_id=message.from_user.id, chat_type=message.chat.type, action_name="twitter")
-    tweet_dir = f"{OUTPUT_DIR}/{tweet_id}"
-    post_caption = tweet_media["text"]
+    await http.download(media_url, file_path)
+
+
+class AlbumItem(NamedTuple):
+    message: types.Message
+    media: object  # FSInputFile لملف تم تنزيله، أو file_id محفوظ مسبقاً
+    file_path: Optional[str]
+    cache_key: str
+    caption: str
+
+
+def media_cache_key(tweet_id, idx):
+    return f"{canonical_url('twitter', f'https://x.com/i/status/{tweet_id}')}/media/{idx}"
+
+
+async def reply_failed(items):
+    """إبلاغ كل محادثة لها عناصر في الألبوم الذي فشل إرساله"""
+    # رسالة المستخدم تكون قد حُذفت غالباً عند إرسال الألبوم، لذا نرسل رسالة جديدة بدل الرد أو التفاعل عليها
+    messages = {}
+    for item in items:
+        messages.setdefault(item.message.chat.id, item.message)
+
+    for message in messages.values():
+        try:
+            await message.answer("Something went wrong :(\nPlease try again later.")
+        except Exception as e:
+            print(e)
+
+
+async def send_album(key, items):
+    """إرسال ألبوم واحد من الصور أو الفيديوهات، حفظ file_id لكل عنصر، ثم حذف ملفاته من القرص"""
+    _, media_type = key
+    message = items[-1].message
+
+    if media_type == "image":
+        media_group = MediaGroupBuilder(caption=items[-1].caption)
+        for item in items:
+            media_group.add_photo(media=item.media)
+    else:
+        # إضافة وصف "فيديو" للألبوم
+        media_group = MediaGroupBuilder(caption="فيديو")
+        for item in items:
+            media_group.add_video(media=item.media)
+
+    try:
+        # RateLimitMiddleware في جلسة البوت يضبط وتيرة الإرسال ويعيد المحاولة عند TelegramRetryAfter
+        sent_messages = await message.answer_media_group(media_group.build())
+    except Exception as e:
+        print(f"Error sending album: {e}")
+        await reply_failed(items)
+        return
+    finally:
+        # حذف الملفات المرسلة من القرص
+        for item in items:
+            if item.file_path is None:
+                continue
+            dir_path = os.path.dirname(item.file_path)
+            if os.path.exists(item.file_path):
+                os.remove(item.file_path)
+            if os.path.exists(dir_path) and not os.listdir(dir_path):
+                os.rmdir(dir_path)
+
+    # حفظ file_id لكل وسيط جديد حتى تُرسل التغريدة نفسها لاحقاً دون أي تنزيل
+    for item, sent in zip(items, sent_messages):
+        if item.file_path is None:
+            continue
+        if sent.photo:
+            file_id = sent.photo[-1].file_id
+        else:
+            file_id = (sent.video or sent.animation).file_id
+        await db.add_file(item.cache_key, file_id, media_type)
+
+
+# لكل chat_id، تُجمع الصور والفيديوهات بشكل منفصل وتُرسل كألبوم عند اكتماله أو بعد ALBUM_MAX_WAIT ثانية
+albums = MediaBatcher(send_album)
+
+
+async def reply_media(message, tweets, bot_url, business_id):
+    """معالجة وسائط كل التغريدات في الرسالة مع تخزين الصور والفيديوهات منفصلين
+
+    tweets: [(tweet_id, tweet_media), ...]
+    """
+    await asyncio.gather(*(send_analytics(user_id=message.from_user.id, chat_type=message.chat.type,
+                                          action_name="twitter") for _ in tweets))
     user_captions = await db.get_user_captions(message.from_user.id)
 
-    if not os.path.exists(tweet_dir):
-        os.makedirs(tweet_dir)
+    items = []
+    for tweet_id, tweet_media in tweets:
+        tweet_dir = f"{OUTPUT_DIR}/{tweet_id}"
+        for idx, media in enumerate(tweet_media['media_extended']):
+            items.append((tweet_dir, tweet_media["text"], media, media_cache_key(tweet_id, idx)))
+
+    # الوسائط التي أُرسلت من قبل تُعاد بـ file_id الخاص بها دون تنزيل
+    cached = await asyncio.gather(*(db.get_file_id(cache_key) for _, _, _, cache_key in items))
+    file_ids = [rows[0][0] if rows else None for rows in cached]
+    items = [item + (file_id,) for item, file_id in zip(items, file_ids)]
 
-    key = message.chat.id
-    # تهيئة القاموس الخاص بأنواع الوسائط إن لم يكن موجوداً
-    if key not in album_accumulator:
-        album_accumulator[key] = {"image": [], "video": []}
+    async def fetch(item):
+        tweet_dir, post_caption, media, cache_key, file_id = item
+        caption = bm.captions(user_captions, post_caption, bot_url)
+        if file_id:
+            return AlbumItem(message, file_id, None, cache_key, caption), media['type']
+
+        os.makedirs(tweet_dir, exist_ok=True)
+        file_name = os.path.join(tweet_dir, os.path.basename(urlsplit(media['url']).path))
+        await download_media(media['url'], file_name)
+        return AlbumItem(message, FSInputFile(file_name), file_name, cache_key, caption), media['type']
 
     try:
-        # تنزيل الوسائط وتخزينها بناءً على النوع
-        for media in tweet_media['media_extended']:
-            media_url = media['url']
-            media_type = media['type']
-            file_name = os.path.join(tweet_dir, os.path.basename(urlsplit(media_url).path))
-            await download_media(media_url, file_name)
-
-            if media_type == 'image':
-                album_accumulator[key]["image"].append((file_name, media_type, tweet_dir))
-            elif media_type in ['video', 'gif']:
-                album_accumulator[key]["video"].append((file_name, media_type, tweet_dir))
-
-        # إرسال الصور إذا كانت هناك 5 صور أو أكثر
-        if len(album_accumulator[key]["image"]) >= 5:
-            album_to_send = album_accumulator[key]["image"][:5]
-            media_group = MediaGroupBuilder(caption=bm.captions(user_captions, post_caption, bot_url))
-            for file_path, media_type, _ in album_to_send:
-                media_group.add_photo(media=FSInputFile(file_path))
-
-            while True:
-                try:
-                    sent_messages = await message.answer_media_group(media_group.build())
-                    break  # إذا تم الإرسال بنجاح، نخرج من الحلقة
-                except TelegramRetryAfter as e:
-                    print(f"TelegramRetryAfter: الانتظار لمدة {e.retry_after} ثانية قبل إعادة المحاولة")
-                    await asyncio.sleep(e.retry_after)
-
-            # إزالة الصور المرسلة من القائمة
-            album_accumulator[key]["image"] = album_accumulator[key]["image"][5:]
-
-            # حذف الملفات المرسلة من القرص
-            for file_path, _, dir_path in album_to_send:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                if os.path.exists(dir_path) and not os.listdir(dir_path):
-                    os.rmdir(dir_path)
-
-            # إضافة تأخير بعد إرسال الألبوم لتجنب الحظر
-            await asyncio.sleep(5)
-
-        # إرسال الفيديوهات إذا كانت هناك 5 فيديوهات أو أكثر
-        if len(album_accumulator[key]["video"]) >= 5:
-            album_to_send = album_accumulator[key]["video"][:5]
-
-            # إضافة وصف "فيديو" للألبوم
-            media_group = MediaGroupBuilder(caption="فيديو")
-            for file_path, media_type, _ in album_to_send:
-                media_group.add_video(media=FSInputFile(file_path))
-
-            while True:
-                try:
-                    sent_messages = await message.answer_media_group(media_group.build())
-                    break
-                except TelegramRetryAfter as e:
-                    print(f"TelegramRetryAfter: الانتظار لمدة {e.retry_after} ثانية قبل إعادة المحاولة")
-                    await asyncio.sleep(e.retry_after)
-
-            album_accumulator[key]["video"] = album_accumulator[key]["video"][5:]
-
-            for file_path, _, dir_path in album_to_send:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                if os.path.exists(dir_path) and not os.listdir(dir_path):
-                    os.rmdir(dir_path)
-
-            # إضافة تأخير بعد إرسال الألبوم لتجنب الحظر
-            await asyncio.sleep(5)
+        # تنزيل وسائط كل التغريدات في آن واحد (يحدّها حد الاتصالات لكل مضيف في HttpClient)،
+        # وتمرير كل دفعة مكتملة إلى albums بينما يستمر تنزيل الباقي
+        slot = scheduler.slot("twitter", message) if not all(file_ids) else None
+        async with aclosing(fetch_in_chunks(items, fetch, albums.size, workers=max(len(items), 1),
+                                            slot=slot)) as chunks:
+            async for downloaded in chunks:
+                for album_item, media_type in downloaded:
+                    if media_type == 'image':
+                        await albums.add((message.chat.id, "image"), album_item)
+                    elif media_type in ['video', 'gif']:
+                        await albums.add((message.chat.id, "video"), album_item)
+
+    except QueueFullError as e:
+        print(e)
+        await message.reply(bm.queue_full())
 
     except Exception as e:
         print(e)
@@ -149,52 +186,55 @@ async def reply_media(message, tweet_id, tweet_media, bot_url, business_id):
             await message.reply("Something went wrong :(\nPlease try again later.")
 
 
-async def process_chat_queue(chat_id):
-    """معالجة الرسائل في قائمة الانتظار بالتتابع"""
-    while True:
-        message = await chat_queues[chat_id].get()
-        try:
-            # تأخير زمني بين كل رسالة يتم استقبالها
-            await asyncio.sleep(1)
+async def process_message(message):
+    """معالجة رسالة واحدة؛ رسائل الدردشة نفسها تُعالج بالتتابع عبر chat_pool"""
+    business_id = message.business_connection_id
+    if business_id is None:
+        react = types.ReactionTypeEmoji(emoji="👨‍💻")
+        await message.react([react])
+
+    bot_url = await bot_context.bot_url()
+    tweet_ids = await extract_tweet_ids(message.text)
+
+    if tweet_ids:
+        if business_id is None:
+            await bot.send_chat_action(message.chat.id, "typing")
+
+        # جلب بيانات كل التغريدات بالتوازي
+        scraped = await asyncio.gather(*(tweet_cache.get(tweet_id) for tweet_id in tweet_ids),
+                                       return_exceptions=True)
+        tweets = []
+        for tweet_id, media in zip(tweet_ids, scraped):
+            if isinstance(media, Exception):
+                print(f"Error scraping tweet {tweet_id}: {media}")
+            else:
+                tweets.append((tweet_id, media))
 
-            business_id = message.business_connection_id
+        if tweets:
+            await reply_media(message, tweets, bot_url, business_id)
+        else:
             if business_id is None:
-                react = types.ReactionTypeEmoji(emoji="👨‍💻")
+                react = types.ReactionTypeEmoji(emoji="👎")
                 await message.react([react])
+            await message.reply("Something went wrong :(\nPlease try again later.")
 
-            bot_url = f"t.me/{(await bot.get_me()).username}"
-            tweet_ids = extract_tweet_ids(message.text)
-
-            if tweet_ids:
-                if business_id is None:
-                    await bot.send_chat_action(message.chat.id, "typing")
+        try:
+            await message.delete()
+        except Exception as delete_error:
+            print(f"Error deleting message: {delete_error}")
+    else:
+        if business_id is None:
+            react = types.ReactionTypeEmoji(emoji="👎")
+            await message.react([react])
+        await message.answer("No tweet IDs found.")
 
-                for tweet_id in tweet_ids:
-                    media = scrape_media(tweet_id)
-                    await reply_media(message, tweet_id, media, bot_url, business_id)
-                    # تأخير زمني بين معالجة كل تغريدة
-                    await asyncio.sleep(3)
 
-                await asyncio.sleep(2)
-                try:
-                    await message.delete()
-                except Exception as delete_error:
-                    print(f"Error deleting message: {delete_error}")
-            else:
-                if business_id is None:
-                    react = types.ReactionTypeEmoji(emoji="👎")
-                    await message.react([react])
-                await message.answer("No tweet IDs found.")
-        finally:
-            chat_queues[chat_id].task_done()
+# عدد ثابت من العمال لكل الدردشات، مع الحفاظ على ترتيب الرسائل داخل كل دردشة وحذف قوائمها عند فراغها
+chat_pool = KeyedWorkerPool(process_message)
 
 
 @router.message(F.text.regexp(r"(https?://(www\.)?(twitter|x)\.com/\S+|https?://t\.co/\S+)"))
 @router.business_message(F.text.regexp(r"(https?://(www\.)?(twitter|x)\.com/\S+|https?://t\.co/\S+)"))
 async def handle_tweet_links(message):
     """إضافة الرسالة إلى قائمة الانتظار الخاصة بالدردشة"""
-    chat_id = message.chat.id
-    if chat_id not in chat_queues:
-        chat_queues[chat_id] = asyncio.Queue()
-        chat_workers[chat_id] = asyncio.create_task(process_chat_queue(chat_id))
-    await chat_queues[chat_id].put(message)
+    chat_pool.submit(message.chat.id, message)
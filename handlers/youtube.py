@@ -1,50 +1,47 @@
 import asyncio
 import datetime
 import os
-import time
 
-import requests
 from aiogram import types, Router, F
 from aiogram.types import FSInputFile
-from moviepy import VideoFileClip, AudioFileClip
-from pytubefix import YouTube
 from pytubefix.cli import on_progress
 
 import keyboards as kb
 import messages as bm
-from config import OUTPUT_DIR, BOT_TOKEN, admin_id
+from config import OUTPUT_DIR, admin_id, TELEGRAM_UPLOAD_LIMIT
 from handlers.user import update_info
-from main import bot, db, send_analytics
+from main import bot, bot_context, db, inflight, scheduler, send_analytics
+from services.media_probe import probe_media
+from services.scheduler import QueueFullError
+from services.url_normalizer import canonical_url
+from services.youtube_cache import YouTubeCache
+from services.youtube_oauth import YouTubeOAuthManager
+from services.youtube_streams import download_streams, select_streams
 
 MAX_FILE_SIZE = 1 * 1024 * 1024
 
 router = Router()
 
 
-def custom_oauth_verifier(verification_url, user_code):
-    send_message_url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+oauth = YouTubeOAuthManager(bot, admin_id)
+youtube_cache = YouTubeCache()
 
-    params = {
-        "chat_id": admin_id,
-        "text": f"<b>OAuth Verification</b>\n\nOpen this URL in your browser:\n{verification_url}\n\nEnter this code:\n<code>{user_code}</code>",
-        "parse_mode": "HTML"
-    }
 
-    response = requests.get(send_message_url, params=params)
+def download_youtube_video(video, name):
+    video.download(output_path=OUTPUT_DIR, filename=name)
 
-    if response.status_code == 200:
-        print("Message sent successfully.")
-    else:
-        print(f"Failed to send message. Status code: {response.status_code}")
 
-    # Countdown
-    for i in range(30, 0, -5):
-        print(f"{i} seconds remaining")
-        time.sleep(5)
+async def answer_cached_video(message: types.Message, file_id, caption, watch_url):
+    business_id = message.business_connection_id
 
+    if business_id is None:
+        await bot.send_chat_action(message.chat.id, "upload_video")
 
-def download_youtube_video(video, name):
-    video.download(output_path=OUTPUT_DIR, filename=name)
+    await message.answer_video(video=file_id,
+                               caption=caption,
+                               reply_markup=kb.return_audio_download_keyboard("yt",
+                                                                              watch_url) if business_id is None else None,
+                               parse_mode="HTML")
 
 
 # Download video
@@ -55,7 +52,7 @@ async def download_video(message: types.Message):
 
     await send_analytics(user_id=message.from_user.id, chat_type=message.chat.type, action_name="youtube_video")
 
-    bot_url = f"t.me/{(await bot.get_me()).username}"
+    bot_url = await bot_context.bot_url()
     file_type = "video"
 
     url = message.text
@@ -67,58 +64,72 @@ async def download_video(message: types.Message):
         time = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         name = f"{time}_youtube_video.mp4"
 
-        yt = YouTube(url, use_oauth=True, allow_oauth_cache=True, on_progress_callback=on_progress,
-                     oauth_verifier=custom_oauth_verifier)
-        video = yt.streams.filter(res="1080p", file_extension='mp4', progressive=True).first()
+        user_captions = await db.get_user_captions(message.from_user.id)
 
-        if not video:
-            video = yt.streams.filter(progressive=True, file_extension='mp4').order_by('resolution').desc().first()
-            if not video:
-                await message.reply("The URL does not seem to be a valid YouTube video link.")
+        # Check the file_id cache on the id in the URL before touching YouTube at all
+        cache_key = canonical_url("youtube", url)
+        if cache_key:
+            db_file_id = await db.get_file_id(cache_key)
+
+            if db_file_id:
+                cached_yt = youtube_cache.peek(url)
+                caption = bm.captions(user_captions, cached_yt.title if cached_yt else None, bot_url)
+                await answer_cached_video(message, db_file_id[0][0], caption, cache_key)
                 return
 
+        yt = await youtube_cache.get(url, on_progress_callback=on_progress, **oauth.youtube_kwargs())
+        if not yt.streams.filter(file_extension='mp4'):
+            await message.reply("The URL does not seem to be a valid YouTube video link.")
+            return
+
         post_caption = yt.title
 
-        user_captions = await db.get_user_captions(message.from_user.id)
+        caption = bm.captions(user_captions, post_caption, bot_url)
 
-        db_file_id = await db.get_file_id(yt.watch_url)
+        if cache_key is None:
+            cache_key = yt.watch_url
 
-        if db_file_id:
-            if business_id is None:
-                await bot.send_chat_action(message.chat.id, "upload_video")
+            db_file_id = await db.get_file_id(cache_key)
 
-            await message.answer_video(video=db_file_id[0][0],
-                                       caption=bm.captions(user_captions, post_caption, bot_url),
-                                       reply_markup=kb.return_audio_download_keyboard("yt",
-                                                                                      yt.watch_url) if business_id is None else None,
-                                       parse_mode="HTMl")
-            return
+            if db_file_id:
+                await answer_cached_video(message, db_file_id[0][0], caption, yt.watch_url)
+                return
 
-        size = video.filesize_kb
+        # Best adaptive video + audio pair that Telegram will accept, remuxed by ffmpeg; progressive as a fallback
+        video, audio = await asyncio.to_thread(select_streams, yt.streams, TELEGRAM_UPLOAD_LIMIT)
 
-        if size < MAX_FILE_SIZE:
+        if video:
             video_file_path = os.path.join(OUTPUT_DIR, name)
-            loop = asyncio.get_event_loop()
-            await loop.run_in_executor(None, download_youtube_video, video, name)
 
-            video_clip = VideoFileClip(video_file_path)
+            async def download_and_send():
+                async with scheduler.slot("youtube", message):
+                    await download_streams(video, audio, OUTPUT_DIR, name)
 
-            width, height = video_clip.size
+                video_info = await probe_media(video_file_path)
 
-            if business_id is None:
-                await bot.send_chat_action(message.chat.id, "upload_video")
+                width, height = video_info.width, video_info.height
+
+                if business_id is None:
+                    await bot.send_chat_action(message.chat.id, "upload_video")
 
-            sent_message = await message.answer_video(video=FSInputFile(video_file_path),
-                                                      width=width,
-                                                      height=height,
-                                                      caption=bm.captions(user_captions, post_caption, bot_url),
-                                                      reply_markup=kb.return_audio_download_keyboard("yt",
-                                                                                                     yt.watch_url) if business_id is None else None)
-            file_id = sent_message.video.file_id
+                sent_message = await message.answer_video(video=FSInputFile(video_file_path),
+                                                          width=width,
+                                                          height=height,
+                                                          caption=caption,
+                                                          reply_markup=kb.return_audio_download_keyboard("yt",
+                                                                                                         yt.watch_url) if business_id is None else None)
+                file_id = sent_message.video.file_id
 
-            await db.add_file(yt.watch_url, file_id, file_type)
+                await db.add_file(cache_key, file_id, file_type)
+                return file_id
 
-            await asyncio.sleep(5)
+            # Concurrent requests for the same video wait for one download and reuse its file_id
+            file_id, shared = await inflight.do(cache_key, download_and_send)
+
+            if shared:
+                await answer_cached_video(message, file_id, caption, yt.watch_url)
+            else:
+                await asyncio.sleep(5)
 
         else:
             if business_id is None:
@@ -127,6 +138,10 @@ async def download_video(message: types.Message):
 
             await message.reply("The video is too large.")
 
+    except QueueFullError as e:
+        print(e)
+        await message.reply(bm.queue_full())
+
     except Exception as e:
         print(e)
         if business_id is None:
@@ -140,15 +155,14 @@ async def download_video(message: types.Message):
 
 @router.callback_query(F.data.startswith('yt_audio_'))
 async def download_audio(call: types.CallbackQuery):
-    bot_url = f"t.me/{(await bot.get_me()).username}"
+    bot_url = await bot_context.bot_url()
 
     url = call.data.split('_')[2]
 
     time = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
     name = f"{time}_youtube_audio.mp3"
 
-    yt = YouTube(url, use_oauth=True, allow_oauth_cache=True, on_progress_callback=on_progress,
-                 oauth_verifier=custom_oauth_verifier)
+    yt = await youtube_cache.get(url, on_progress_callback=on_progress, **oauth.youtube_kwargs())
     audio = yt.streams.filter(only_audio=True, file_extension='mp4').first()
 
     if not audio:
@@ -159,8 +173,14 @@ async def download_audio(call: types.CallbackQuery):
 
     audio_file_path = os.path.join(OUTPUT_DIR, name)
 
-    loop = asyncio.get_event_loop()
-    await loop.run_in_executor(None, download_youtube_video, audio, name)
+    try:
+        async with scheduler.slot("youtube", call.message):
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, download_youtube_video, audio, name)
+    except QueueFullError as e:
+        print(e)
+        await call.answer(bm.queue_full(), show_alert=True)
+        return
 
     # Check file size
     if file_size > MAX_FILE_SIZE:
@@ -168,8 +188,8 @@ async def download_audio(call: types.CallbackQuery):
         await call.message.reply("The audio file is too large.")
         return
 
-    audio_duration = AudioFileClip(audio_file_path)
-    duration = round(audio_duration.duration)
+    audio_info = await probe_media(audio_file_path)
+    duration = audio_info.duration
 
     await call.answer()
 
@@ -196,7 +216,7 @@ async def download_music(message: types.Message):
 
     await send_analytics(user_id=message.from_user.id, chat_type=message.chat.type, action_name="youtube_audio")
 
-    bot_url = f"t.me/{(await bot.get_me()).username}"
+    bot_url = await bot_context.bot_url()
     url = message.text
 
     if business_id is None:
@@ -206,8 +226,7 @@ async def download_music(message: types.Message):
         time = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         name = f"{time}_youtube_audio.mp3"
 
-        yt = YouTube(url, use_oauth=True, allow_oauth_cache=True, on_progress_callback=on_progress,
-                     oauth_verifier=custom_oauth_verifier)
+        yt = await youtube_cache.get(url, on_progress_callback=on_progress, **oauth.youtube_kwargs())
         audio = yt.streams.filter(only_audio=True, file_extension='mp4').first()
 
         if not audio:
@@ -218,16 +237,17 @@ async def download_music(message: types.Message):
 
         audio_file_path = os.path.join(OUTPUT_DIR, name)
 
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, download_youtube_video, audio, name)
+        async with scheduler.slot("youtube", message):
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, download_youtube_video, audio, name)
 
         if file_size > MAX_FILE_SIZE:
             os.remove(audio_file_path)
             await message.reply("The audio file is too large.")
             return
 
-        audio_duration = AudioFileClip(audio_file_path)
-        duration = round(audio_duration.duration)
+        audio_info = await probe_media(audio_file_path)
+        duration = audio_info.duration
 
         if business_id is None:
             await bot.send_chat_action(message.chat.id, "upload_voice")
@@ -239,6 +259,9 @@ async def download_music(message: types.Message):
 
         await asyncio.sleep(5)
         os.remove(audio_file_path)
+    except QueueFullError as e:
+        print(e)
+        await message.reply(bm.queue_full())
     except Exception as e:
         print(e)
         if business_id is None:
@@ -1,7 +1,8 @@
 import os
 import random
 
-import requests
+from main import http, resolver
+from services.url_normalizer import is_short_link
 
 USER_AGENTS = [
     'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/117.0.0.0 Safari/537.36',
@@ -32,17 +33,14 @@ def random_ua():
     return random.choice(USER_AGENTS)
 
 
-def get_content(url: str, output_dir: str, output_name: str):
+async def get_content(url: str, output_dir: str, output_name: str):
     try:
-        res = requests.get(url, stream=True, timeout=1000)
-        if res.headers.get('Content-Type', '').find('audio/mpeg') >= 0:
-            return False
+        async with http.stream(url) as res:
+            if res.headers.get('Content-Type', '').find('audio/mpeg') >= 0:
+                return False
 
-        output_path = os.path.join(output_dir, output_name)
-
-        with open(output_path, "wb") as w:
-            for data in res.iter_content(chunk_size=2048):
-                w.write(data)
+            output_path = os.path.join(output_dir, output_name)
+            await http.save(res, output_path)
         return True
 
     except Exception as e:
@@ -50,10 +48,7 @@ def get_content(url: str, output_dir: str, output_name: str):
         return False
 
 
-def expand_tiktok_url(short_url: str) -> str:
-    try:
-        response = requests.head(short_url, allow_redirects=True, headers={'User-Agent': random_ua()})
-        return response.url
-    except requests.RequestException as e:
-        print(f"Error expanding URL: {e}")
+async def expand_tiktok_url(short_url: str) -> str:
+    if not is_short_link(short_url):
         return short_url
+    return await resolver.resolve(short_url, headers={'User-Agent': random_ua()})
@@ -9,8 +9,16 @@ from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums.parse_mode import ParseMode
 from aiocron import crontab
 
-from config import BOT_TOKEN, BOT_COMMANDS, OUTPUT_DIR, custom_api_url, MEASUREMENT_ID, API_SECRET
+from config import BOT_TOKEN, BOT_COMMANDS, OUTPUT_DIR, custom_api_url, MEASUREMENT_ID, API_SECRET, DOWNLOAD_LIMITS, \
+    DOWNLOAD_GLOBAL_LIMIT, DOWNLOAD_QUEUE_LIMIT
+from services.bot_context import BotContext
+from services.broadcast import Broadcaster
 from services.db import DataBase
+from services.http_client import HttpClient
+from services.link_resolver import LinkResolver
+from services.rate_limiter import ChatRateLimiter
+from services.scheduler import DownloadScheduler
+from services.single_flight import SingleFlight
 
 logging.basicConfig(level=logging.INFO)
 
@@ -23,10 +31,24 @@ session = AiohttpSession(
 default = DefaultBotProperties(parse_mode=ParseMode.HTML)
 bot = Bot(token=BOT_TOKEN, default=default, session=session)
 
+bot_context = BotContext(bot)
+
 dp = Dispatcher()
 
 db = DataBase()
 
+http = HttpClient()
+
+resolver = LinkResolver(http, db)
+
+limiter = ChatRateLimiter()
+
+scheduler = DownloadScheduler(DOWNLOAD_LIMITS, DOWNLOAD_GLOBAL_LIMIT, DOWNLOAD_QUEUE_LIMIT)
+
+inflight = SingleFlight()
+
+broadcaster = Broadcaster(bot, db)
+
 os.makedirs("downloads", exist_ok=True)
 
 
@@ -49,24 +71,43 @@ async def main():
     import handlers
     import middlewares
     from handlers.admin import clear_downloads_and_notify
+    from handlers.twitter import albums
+    from middlewares.rate_limit import RateLimitMiddleware
 
     if not os.path.exists(OUTPUT_DIR):
         os.makedirs(OUTPUT_DIR)
 
+    await db.connect()
+    # Send the albums still waiting for more media (and save their file_ids) before the db and session close
+    dp.shutdown.register(albums.flush_all)
+    dp.shutdown.register(db.close)
+    dp.shutdown.register(http.close)
+
+    # Every Bot API send goes through the shared limiter, so handlers need no sleeps or retry loops
+    bot.session.middleware(RateLimitMiddleware(limiter))
+
     dp.include_router(handlers.router)
     for middleware in middlewares.__all__:
         dp.message.outer_middleware(middleware())
         dp.callback_query.outer_middleware(middleware())
         dp.inline_query.outer_middleware(middleware())
+    await bot_context.refresh()
     await bot.set_my_commands(commands=BOT_COMMANDS)
     await bot.delete_webhook(drop_pending_updates=True)
 
     crontab('0 0 * * *', func=clear_downloads_and_notify, start=True)
 
+    # Mailings interrupted by a restart continue from their last checkpoint
+    await broadcaster.resume()
+
     await dp.start_polling(bot)
 
 
 if __name__ == "__main__":
     import asyncio
 
-    asyncio.run(main())
+    # Handlers and middlewares do `from main import bot, db`, which loads this file a second time as the
+    # `main` module. Run that module's main() so startup (db.connect) and handlers share the same objects.
+    import main as app
+
+    asyncio.run(app.main())
@@ -23,6 +23,37 @@ def start_mailing():
     return ("Starting mailing...")
 
 
+def mailing_progress(sent, failed, total, rate, eta):
+    return ("""<b>Mailing in progress...</b>
+
+✅Sent: <b>{sent}</b>
+❌Failed: <b>{failed}</b>
+👥Total: <b>{total}</b>
+⚡Speed: <b>{rate:.1f}</b> msg/s
+⏳ETA: <b>{eta}</b>""").format(sent=sent, failed=failed, total=total, rate=rate, eta=eta)
+
+
+def mailing_stats(sent, failed, total):
+    return ("""<b>Mailing is complete!</b>
+
+✅Sent: <b>{sent}</b>
+❌Failed: <b>{failed}</b>
+👥Total: <b>{total}</b>""").format(sent=sent, failed=failed, total=total)
+
+
+def mailing_stopped(sent, failed, total):
+    return ("""<b>Mailing stopped: the database is unavailable.</b>
+It will resume from where it stopped after the next restart.
+
+✅Sent: <b>{sent}</b>
+❌Failed: <b>{failed}</b>
+👥Total: <b>{total}</b>""").format(sent=sent, failed=failed, total=total)
+
+
+def mailing_resumed():
+    return ("Resuming the interrupted mailing...")
+
+
 def mailing_message():
     return ('Enter the message to send:')
 
@@ -21,5 +21,13 @@ def captions(user_captions, post_caption, bot_url):
 
 
 
+def queued(position):
+    return ("⏳Your download is queued, position: {position}").format(position=position)
+
+
+def queue_full():
+    return ("Too many downloads right now, please try again in a minute.")
+
+
 def join_group(chat_title):
     return ("Hi! Thank you for adding me to <b>'{chat_title}'</b>!\nHave a nice day!").format(chat_title=chat_title)
@@ -10,10 +10,10 @@ class UserBannedMiddleware(BaseMiddleware):
 
     async def on_pre_process_message(self, message: Message, data: dict):
         try:
-            user_status = await db.status(message.from_user.id)
+            banned = await db.is_banned(message.from_user.id)
         except:
-            user_status = 'active'
-        if user_status == 'ban':
+            banned = False
+        if banned:
             if message.chat.type == 'private':
                 await message.answer(('You are banned please contact to @mak5er for more information!'),
                                      parse_mode='HTML')
@@ -21,20 +21,20 @@ class UserBannedMiddleware(BaseMiddleware):
 
     async def on_pre_process_callback_query(self, callback_query: CallbackQuery, data: dict):
         try:
-            user_status = await db.status(callback_query.from_user.id)
+            banned = await db.is_banned(callback_query.from_user.id)
         except:
-            user_status = 'active'
-        if user_status == 'ban':
+            banned = False
+        if banned:
             await callback_query.answer(('You are banned please contact to @mak5er for more information!'),
                                         show_alert=True)
             raise asyncio.CancelledError
 
     async def on_pre_process_inline_query(self, inline_query: InlineQuery, data: dict):
         try:
-            user_status = await db.status(inline_query.from_user.id)
+            banned = await db.is_banned(inline_query.from_user.id)
         except:
-            user_status = 'active'
-        if user_status == 'ban':
+            banned = False
+        if banned:
             raise asyncio.CancelledError
 
     async def __call__(self, handler, event, data):
@@ -0,0 +1,51 @@
+import asyncio
+from typing import TYPE_CHECKING, Any
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+import config
+
+if TYPE_CHECKING:
+    from aiogram import Bot
+
+# Methods that post into a chat and count against Telegram's flood limits
+PACED_PREFIXES = ("Send", "Forward", "Copy")
+UNPACED_METHODS = {"SendChatAction"}
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """Paces every outgoing send through the shared ChatRateLimiter and retries on flood control.
+
+    Installed on the bot session, so all answer_*/send_*/forward calls are covered without the
+    handlers knowing about it.
+    """
+
+    def __init__(self, limiter, max_retries=config.TELEGRAM_MAX_RETRIES):
+        self.limiter = limiter
+        self.max_retries = max_retries
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: "Bot",
+            method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = type(method).__name__
+        paced = name.startswith(PACED_PREFIXES) and name not in UNPACED_METHODS
+        chat_id: Any = getattr(method, "chat_id", None)
+        # Every item of an album is a message of its own as far as flood control is concerned
+        tokens = len(method.media) if name == "SendMediaGroup" else 1
+
+        for attempt in range(self.max_retries + 1):
+            if paced:
+                await self.limiter.acquire(chat_id, tokens)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"Flood control on {name} to {chat_id}, retrying in {e.retry_after} s")
+                await asyncio.sleep(e.retry_after)
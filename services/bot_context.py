@@ -0,0 +1,42 @@
+import asyncio
+import time
+
+import config
+
+
+class BotContext:
+    """Bot identity fetched once at startup and shared by all handlers.
+
+    Once the cached getMe result is older than ttl, it is refreshed in the background while callers
+    keep getting the cached value, so building bot_url never costs a Telegram round trip.
+    """
+
+    def __init__(self, bot, ttl=config.BOT_INFO_TTL):
+        self.bot = bot
+        self.ttl = ttl
+        self.me = None
+        self.fetched_at = 0.0
+        self.refresh_task = None
+
+    async def refresh(self):
+        self.me = await self.bot.get_me()
+        self.fetched_at = time.monotonic()
+        return self.me
+
+    async def background_refresh(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            print(f"Error refreshing bot info: {e}")
+
+    async def get_me(self):
+        if self.me is None:
+            return await self.refresh()
+
+        stale = time.monotonic() - self.fetched_at > self.ttl
+        if stale and (self.refresh_task is None or self.refresh_task.done()):
+            self.refresh_task = asyncio.create_task(self.background_refresh())
+        return self.me
+
+    async def bot_url(self):
+        return f"t.me/{(await self.get_me()).username}"
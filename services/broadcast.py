@@ -0,0 +1,131 @@
+import asyncio
+import time
+from datetime import timedelta
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+import config
+import messages as bm
+
+
+class Broadcaster:
+    """Forwards an admin message to every user with bounded concurrency.
+
+    Users are paged by id. After each page the status changes (reactivated, blocked, deleted) are
+    written in one transaction together with the mailing's checkpoint, so a restart resumes after the
+    last finished page instead of starting over. The bot session's rate limiter keeps the sends within
+    Telegram's limits; the admin gets a progress message with throughput and ETA.
+    """
+
+    def __init__(self, bot, db, concurrency=config.BROADCAST_CONCURRENCY, batch_size=config.BROADCAST_BATCH_SIZE,
+                 progress_interval=config.BROADCAST_PROGRESS_INTERVAL):
+        self.bot = bot
+        self.db = db
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+        self.tasks = {}
+
+    async def start(self, admin_chat_id, from_chat_id, message_id):
+        total = await self.db.user_count() or 0
+        mailing = await self.db.create_mailing(admin_chat_id, from_chat_id, message_id, total)
+        if mailing is None:
+            raise Exception("Could not create mailing")
+        self.spawn(mailing)
+        return mailing['id']
+
+    async def resume(self):
+        for mailing in await self.db.get_running_mailings():
+            if mailing['id'] in self.tasks:
+                continue
+            try:
+                await self.bot.send_message(mailing['admin_chat_id'], bm.mailing_resumed())
+            except Exception as e:
+                print(e)
+            self.spawn(mailing)
+
+    def spawn(self, mailing):
+        task = asyncio.create_task(self.run(mailing))
+        self.tasks[mailing['id']] = task
+        task.add_done_callback(lambda _: self.tasks.pop(mailing['id'], None))
+
+    async def send(self, semaphore, mailing, user_id):
+        """Forward the message to one user; returns 'sent', 'inactive', 'deleted' or 'failed'."""
+        async with semaphore:
+            try:
+                await self.bot.forward_message(chat_id=user_id,
+                                               from_chat_id=mailing['from_chat_id'],
+                                               message_id=mailing['message_id'])
+                return "sent"
+            except TelegramForbiddenError as e:
+                if "bots can't send messages to bots" in str(e):
+                    return "deleted"
+                return "inactive"
+            except TelegramBadRequest as e:
+                if "chat not found" in str(e).lower():
+                    return "inactive"
+                print(f"Mailing to {user_id} failed: {e}")
+                return "failed"
+            except Exception as e:
+                print(f"Mailing to {user_id} failed: {e}")
+                return "failed"
+
+    async def run(self, mailing):
+        mailing_id = mailing['id']
+        total = mailing['total']
+        last_user_id = mailing['last_user_id']
+        sent, failed = mailing['sent'], mailing['failed']
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        progress_message = None
+        started_at, started_done = time.monotonic(), sent + failed
+        reported_at = 0.0
+
+        try:
+            while True:
+                user_ids = await self.db.users_after(last_user_id, self.batch_size)
+                if user_ids is None:
+                    # Database unavailable: leave the mailing 'running' so the next start resumes it
+                    await self.report(mailing['admin_chat_id'], progress_message,
+                                      bm.mailing_stopped(sent, failed, total))
+                    return
+                if not user_ids:
+                    break
+
+                results = await asyncio.gather(*(self.send(semaphore, mailing, user_id) for user_id in user_ids))
+
+                delivered = [user_id for user_id, result in zip(user_ids, results) if result == "sent"]
+                deactivated = [user_id for user_id, result in zip(user_ids, results) if result == "inactive"]
+                deleted = [user_id for user_id, result in zip(user_ids, results) if result == "deleted"]
+                sent += len(delivered)
+                failed += len(user_ids) - len(delivered)
+                last_user_id = user_ids[-1]
+
+                if not await self.db.save_mailing_progress(mailing_id, last_user_id, sent, failed,
+                                                           delivered, deactivated, deleted):
+                    # The checkpoint is still at the previous page, which is where a restart picks up
+                    await self.report(mailing['admin_chat_id'], progress_message,
+                                      bm.mailing_stopped(sent, failed, total))
+                    return
+
+                if time.monotonic() - reported_at >= self.progress_interval:
+                    reported_at = time.monotonic()
+                    rate = (sent + failed - started_done) / max(reported_at - started_at, 1e-6)
+                    remaining = max(total - sent - failed, 0)
+                    eta = timedelta(seconds=int(remaining / rate)) if rate else "-"
+                    text = bm.mailing_progress(sent, failed, total, rate, eta)
+                    progress_message = await self.report(mailing['admin_chat_id'], progress_message, text)
+
+            await self.db.finish_mailing(mailing_id)
+            await self.report(mailing['admin_chat_id'], progress_message, bm.mailing_stats(sent, failed, total))
+        except Exception as e:
+            print(f"Mailing {mailing_id} stopped: {e}")
+
+    async def report(self, chat_id, progress_message, text):
+        try:
+            if progress_message is None:
+                return await self.bot.send_message(chat_id, text)
+            await progress_message.edit_text(text)
+        except Exception as e:
+            print(f"Error reporting mailing progress: {e}")
+        return progress_message
@@ -1,18 +1,46 @@
-from datetime import datetime, timedelta
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
 
-import psycopg2
+import asyncpg
+from cachetools import TTLCache
 
 import config
 
+DB_ERRORS = (asyncpg.PostgresError, asyncpg.InterfaceError, OSError)
+# Mailing checkpoint before the first user; group chats are stored under negative ids
+MIN_USER_ID = -2 ** 63
 
-class DataBase:
 
-    def __init__(self):
-        self.connect = psycopg2.connect(config.db_auth)
-        self.cursor = self.connect.cursor()
-        self.create_tables()
+class DataBase:
 
-    def create_tables(self):
+    def __init__(self, dsn=config.db_auth, min_size=config.DB_POOL_MIN_SIZE, max_size=config.DB_POOL_MAX_SIZE):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+        # url -> file_id rows, so repeat links skip the downloaded_files round trip
+        self.file_id_cache = TTLCache(maxsize=config.FILE_ID_CACHE_SIZE, ttl=config.FILE_ID_CACHE_TTL)
+        self.file_id_cache_hits = 0
+        self.file_id_cache_misses = 0
+        # user_id -> status with a short TTL; every status write below keeps it in sync
+        self.status_cache = TTLCache(maxsize=config.STATUS_CACHE_SIZE, ttl=config.STATUS_CACHE_TTL)
+        self.banned_ids = set()
+        self.banned_ids_loaded_at = 0.0
+        self.banned_ids_lock = asyncio.Lock()
+
+    async def connect(self):
+        if self.pool is None:
+            self.pool = await asyncpg.create_pool(dsn=self.dsn, min_size=self.min_size, max_size=self.max_size)
+            await self.create_tables()
+            await self.load_banned_ids()
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def create_tables(self):
         create_downloaded_files_table = """
             CREATE TABLE IF NOT EXISTS public.downloaded_files (
                 id BIGINT GENERATED BY DEFAULT AS IDENTITY NOT NULL,
@@ -38,232 +66,423 @@ class DataBase:
             ) TABLESPACE pg_default;
             """
 
-        try:
+        create_short_links_table = """
+            CREATE TABLE IF NOT EXISTS public.short_links (
+                short_url TEXT NOT NULL,
+                long_url TEXT NOT NULL,
+                resolved_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+                CONSTRAINT short_links_pkey PRIMARY KEY (short_url)
+            ) TABLESPACE pg_default;
+            """
+
+        create_tweets_table = """
+            CREATE TABLE IF NOT EXISTS public.tweets (
+                tweet_id TEXT NOT NULL,
+                data TEXT NOT NULL,
+                scraped_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+                CONSTRAINT tweets_pkey PRIMARY KEY (tweet_id)
+            ) TABLESPACE pg_default;
+            """
+
+        create_mailings_table = """
+            CREATE TABLE IF NOT EXISTS public.mailings (
+                id BIGINT GENERATED BY DEFAULT AS IDENTITY NOT NULL,
+                admin_chat_id BIGINT NOT NULL,
+                from_chat_id BIGINT NOT NULL,
+                message_id BIGINT NOT NULL,
+                total INTEGER NOT NULL DEFAULT 0,
+                last_user_id BIGINT NOT NULL DEFAULT -9223372036854775808,
+                sent INTEGER NOT NULL DEFAULT 0,
+                failed INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL DEFAULT 'running',
+                started_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+                finished_at TIMESTAMP WITH TIME ZONE NULL,
+                CONSTRAINT mailings_pkey PRIMARY KEY (id)
+            ) TABLESPACE pg_default;
+            """
 
-            with self.connect:
-                self.cursor.execute(create_downloaded_files_table)
-                self.cursor.execute(create_users_table)
-                print("Tables created or exist")
-        except psycopg2.OperationalError as e:
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    await conn.execute(create_downloaded_files_table)
+                    await conn.execute(create_users_table)
+                    await conn.execute(create_short_links_table)
+                    await conn.execute(create_tweets_table)
+                    await conn.execute(create_mailings_table)
+            print("Tables created or exist")
+        except DB_ERRORS as e:
             print(f"Error: {e}")
             pass
 
+    async def load_banned_ids(self):
+        # Set before the query, so a failed load is not retried until the next refresh interval
+        self.banned_ids_loaded_at = time.monotonic()
+        try:
+            rows = await self.pool.fetch("SELECT user_id FROM users WHERE status = 'ban'")
+        except DB_ERRORS as e:
+            print(e)
+            return
+        self.banned_ids = {row[0] for row in rows}
+
+    def cache_status(self, user_id, status):
+        user_id = int(user_id)
+        self.status_cache[user_id] = status
+        if status == 'ban':
+            self.banned_ids.add(user_id)
+        else:
+            self.banned_ids.discard(user_id)
+
+    def banned_ids_stale(self):
+        return time.monotonic() - self.banned_ids_loaded_at > config.BANNED_IDS_REFRESH
+
+    async def is_banned(self, user_id):
+        if self.banned_ids_stale():
+            # Only one update reloads the set; the others wait for it instead of repeating the scan
+            async with self.banned_ids_lock:
+                if self.banned_ids_stale():
+                    await self.load_banned_ids()
+        return int(user_id) in self.banned_ids
+
     async def add_users(self, user_id, user_name, user_username, chat_type, language, status):
         try:
-            with self.connect:
-                self.cursor.execute(
-                    """INSERT INTO users (user_id, user_name, user_username, chat_type, language, status) 
-                    VALUES (%s, %s, %s, %s, %s, %s) ON CONFLICT (user_id) DO NOTHING;""",
-                    (user_id, user_name, user_username, chat_type, language, status))
+            await self.pool.execute(
+                """INSERT INTO users (user_id, user_name, user_username, chat_type, language, status)
+                VALUES ($1, $2, $3, $4, $5, $6) ON CONFLICT (user_id) DO NOTHING;""",
+                int(user_id), user_name, user_username, chat_type, language, status)
 
-        except psycopg2.OperationalError as e:
+        except DB_ERRORS as e:
             print(e)
             pass
+        self.status_cache.pop(int(user_id), None)
 
     async def delete_user(self, user_id):
         try:
-            with self.connect:
-                self.cursor.execute(
-                    "DELETE FROM users WHERE user_id = %s;",
-                    (user_id,))
-        except psycopg2.OperationalError as e:
+            await self.pool.execute("DELETE FROM users WHERE user_id = $1;", int(user_id))
+        except DB_ERRORS as e:
             print(e)
-            pass
+        else:
+            self.cache_status(user_id, None)
 
     async def user_count(self):
         try:
-            with self.connect:
-                self.cursor.execute("SELECT COUNT(*) FROM users")
-                return self.cursor.fetchone()[0]
-        except psycopg2.OperationalError as e:
+            return await self.pool.fetchval("SELECT COUNT(*) FROM users")
+        except DB_ERRORS as e:
             print(e)
             pass
 
     async def active_user_count(self):
         try:
-            with self.connect:
-                self.cursor.execute("SELECT COUNT(*) FROM users WHERE status = 'active'")
-                return self.cursor.fetchone()[0]
-        except psycopg2.OperationalError as e:
+            return await self.pool.fetchval("SELECT COUNT(*) FROM users WHERE status = 'active'")
+        except DB_ERRORS as e:
             print(e)
             pass
 
     async def inactive_user_count(self):
         try:
-            with self.connect:
-                self.cursor.execute("SELECT COUNT(*) FROM users WHERE status != 'active'")
-                return self.cursor.fetchone()[0]
-        except psycopg2.OperationalError as e:
+            return await self.pool.fetchval("SELECT COUNT(*) FROM users WHERE status != 'active'")
+        except DB_ERRORS as e:
             print(e)
             pass
 
     async def all_users(self):
         try:
-            with self.connect:
-                self.cursor.execute("SELECT user_id FROM users")
-                return self.cursor.fetchall()
+            return await self.pool.fetch("SELECT user_id FROM users")
 
-        except psycopg2.OperationalError as e:
+        except DB_ERRORS as e:
             print(e)
             pass
 
     async def user_exist(self, user_id):
         try:
-            with self.connect:
-                self.cursor.execute("SELECT * FROM users WHERE user_id = %s", (user_id,))
-                return self.cursor.fetchall()
+            return await self.pool.fetch("SELECT * FROM users WHERE user_id = $1", int(user_id))
 
-        except psycopg2.OperationalError as e:
+        except DB_ERRORS as e:
             print(e)
             pass
 
     async def user_update_name(self, user_id, user_name, user_username):
         try:
-            with self.connect:
-                self.cursor.execute("UPDATE users SET user_username = %s, user_name = %s WHERE user_id = %s",
-                                    (user_username, user_name, user_id))
-        except psycopg2.OperationalError as e:
+            await self.pool.execute("UPDATE users SET user_username = $1, user_name = $2 WHERE user_id = $3",
+                                    user_username, user_name, int(user_id))
+        except DB_ERRORS as e:
             print(e)
             pass
 
     async def get_user_captions(self, user_id):
         try:
-            with self.connect:
-                self.cursor.execute("SELECT captions FROM users WHERE user_id = %s", (user_id,))
-                return self.cursor.fetchone()[0]
+            return await self.pool.fetchval("SELECT captions FROM users WHERE user_id = $1", int(user_id))
 
-        except psycopg2.OperationalError as e:
+        except DB_ERRORS as e:
             print(e)
             pass
 
     async def update_captions(self, captions, user_id):
         try:
-            with self.connect:
-                self.cursor.execute("UPDATE users SET captions = %s WHERE user_id = %s",
-                                    (captions, user_id))
-        except psycopg2.OperationalError as e:
+            await self.pool.execute("UPDATE users SET captions = $1 WHERE user_id = $2", captions, int(user_id))
+        except DB_ERRORS as e:
             print(e)
             pass
 
-    async def set_inactive(self, user_id):
+    async def set_status(self, user_id, status):
         try:
-            with self.connect:
-                self.cursor.execute("UPDATE users SET status = %s WHERE user_id = %s", ("inactive", user_id))
-        except psycopg2.OperationalError as e:
+            await self.pool.execute("UPDATE users SET status = $1 WHERE user_id = $2", status, int(user_id))
+        except DB_ERRORS as e:
             print(e)
-            pass
+            self.status_cache.pop(int(user_id), None)
+            return
+        self.cache_status(user_id, status)
+
+    async def set_status_many(self, user_ids, status, only_if=None, conn=None):
+        """Set status for many users in one statement; returns the ids that changed.
+
+        only_if limits the update to users whose current status is in that list. Pass conn to run
+        inside a caller's transaction, in which case errors are raised instead of printed and the caller
+        updates the cache once the transaction has committed.
+        """
+        if not user_ids:
+            return []
+
+        query = "UPDATE users SET status = $1 WHERE user_id = ANY($2::bigint[])"
+        args = [status, [int(user_id) for user_id in user_ids]]
+        if only_if is not None:
+            query += " AND status = ANY($3::text[])"
+            args.append(list(only_if))
 
-    async def set_active(self, user_id):
         try:
-            with self.connect:
-                self.cursor.execute("UPDATE users SET status = %s WHERE user_id = %s", ("active", user_id))
-        except psycopg2.OperationalError as e:
+            rows = await (conn or self.pool).fetch(query + " RETURNING user_id", *args)
+        except DB_ERRORS as e:
+            if conn is not None:
+                raise
             print(e)
-            pass
+            return []
+
+        changed = [row[0] for row in rows]
+        if conn is None:
+            for user_id in changed:
+                self.cache_status(user_id, status)
+        return changed
+
+    async def delete_users_many(self, user_ids, conn=None):
+        """Delete many users in one statement; returns the ids that were removed.
+
+        As with set_status_many, a caller passing conn updates the cache after its transaction commits.
+        """
+        if not user_ids:
+            return []
+
+        try:
+            rows = await (conn or self.pool).fetch(
+                "DELETE FROM users WHERE user_id = ANY($1::bigint[]) RETURNING user_id",
+                [int(user_id) for user_id in user_ids])
+        except DB_ERRORS as e:
+            if conn is not None:
+                raise
+            print(e)
+            return []
+
+        deleted = [row[0] for row in rows]
+        if conn is None:
+            for user_id in deleted:
+                self.cache_status(user_id, None)
+        return deleted
+
+    async def set_inactive(self, user_id):
+        await self.set_status(user_id, "inactive")
+
+    async def set_active(self, user_id):
+        await self.set_status(user_id, "active")
 
     async def status(self, user_id):
+        user_id = int(user_id)
+        if user_id in self.status_cache:
+            return self.status_cache[user_id]
+
         try:
-            with self.connect:
-                self.cursor.execute("SELECT DISTINCT status FROM users WHERE user_id = %s", (user_id,))
-                return self.cursor.fetchone()[0]
-        except psycopg2.OperationalError as e:
+            status = await self.pool.fetchval("SELECT DISTINCT status FROM users WHERE user_id = $1", user_id)
+        except DB_ERRORS as e:
             print(e)
-            pass
+            return None
+        self.status_cache[user_id] = status
+        return status
 
     async def get_user_info(self, user_id):
         try:
-            with self.connect:
-                self.cursor.execute(
-                    "SELECT user_name, user_username, status FROM users WHERE user_id = %s",
-                    (user_id,))
-                return self.cursor.fetchone()
-        except psycopg2.OperationalError as e:
+            return await self.pool.fetchrow(
+                "SELECT user_name, user_username, status FROM users WHERE user_id = $1",
+                int(user_id))
+        except DB_ERRORS as e:
             print(e)
             pass
 
     async def get_user_info_username(self, user_username):
         try:
-            with self.connect:
-                self.cursor.execute(
-                    "SELECT user_name, user_id, status FROM users WHERE user_username = %s",
-                    (user_username,))
-                return self.cursor.fetchone()
-        except psycopg2.OperationalError as e:
+            return await self.pool.fetchrow(
+                "SELECT user_name, user_id, status FROM users WHERE user_username = $1",
+                user_username)
+        except DB_ERRORS as e:
             print(e)
             pass
 
     async def get_all_users_info(self):
         try:
-            with self.connect:
-                self.cursor.execute(
-                    "SELECT user_id, chat_type, user_name, user_username, language, status, referrer_id FROM users")
-                return self.cursor.fetchall()
-        except psycopg2.OperationalError as e:
+            return await self.pool.fetch(
+                "SELECT user_id, chat_type, user_name, user_username, language, status, referrer_id FROM users")
+        except DB_ERRORS as e:
             print(e)
             pass
 
     async def ban_user(self, user_id):
+        await self.set_status(user_id, "ban")
+
+    async def add_file(self, url, file_id, file_type):
         try:
-            with self.connect:
-                self.cursor.execute("UPDATE users SET status = %s WHERE user_id = %s", ("ban", user_id))
-        except psycopg2.OperationalError as e:
+            await self.pool.execute("INSERT INTO downloaded_files (url, file_id, file_type) VALUES ($1, $2, $3)",
+                                    url, file_id, file_type)
+        except DB_ERRORS as e:
+            print(e)
+        else:
+            self.file_id_cache[url] = [(file_id,)]
+
+    async def get_file_id(self, url):
+        cached = self.file_id_cache.get(url)
+        if cached is not None:
+            self.file_id_cache_hits += 1
+            return cached
+        self.file_id_cache_misses += 1
+
+        try:
+            rows = await self.pool.fetch("SELECT file_id FROM downloaded_files WHERE url = $1", url)
+        except DB_ERRORS as e:
+            print(e)
+            return None
+
+        if rows:
+            self.file_id_cache[url] = [(row[0],) for row in rows]
+        return rows
+
+    async def get_short_link(self, short_url, max_age: timedelta):
+        try:
+            return await self.pool.fetchval(
+                "SELECT long_url FROM short_links WHERE short_url = $1 AND resolved_at >= now() - $2::interval",
+                short_url, max_age)
+        except DB_ERRORS as e:
             print(e)
             pass
 
-    async def add_file(self, url, file_id, file_type):
+    async def add_short_link(self, short_url, long_url):
         try:
-            with self.connect:
-                self.cursor.execute("INSERT INTO downloaded_files (url, file_id, file_type) VALUES (%s, %s, %s)",
-                                    (url, file_id, file_type))
-        except psycopg2.OperationalError as e:
+            await self.pool.execute(
+                """INSERT INTO short_links (short_url, long_url) VALUES ($1, $2)
+                ON CONFLICT (short_url) DO UPDATE SET long_url = EXCLUDED.long_url, resolved_at = now()""",
+                short_url, long_url)
+        except DB_ERRORS as e:
             print(e)
             pass
 
-    async def get_file_id(self, url):
+    async def get_tweet(self, tweet_id, max_age: timedelta):
+        try:
+            return await self.pool.fetchval(
+                "SELECT data FROM tweets WHERE tweet_id = $1 AND scraped_at >= now() - $2::interval",
+                str(tweet_id), max_age)
+        except DB_ERRORS as e:
+            print(e)
+            pass
+
+    async def add_tweet(self, tweet_id, data):
+        try:
+            await self.pool.execute(
+                """INSERT INTO tweets (tweet_id, data) VALUES ($1, $2)
+                ON CONFLICT (tweet_id) DO UPDATE SET data = EXCLUDED.data, scraped_at = now()""",
+                str(tweet_id), data)
+        except DB_ERRORS as e:
+            print(e)
+            pass
+
+    async def users_after(self, last_user_id, limit):
+        """Next page of user ids in id order (keyset pagination, so a mailing can resume from any id)."""
+        try:
+            rows = await self.pool.fetch("SELECT user_id FROM users WHERE user_id > $1 ORDER BY user_id LIMIT $2",
+                                         int(last_user_id), limit)
+        except DB_ERRORS as e:
+            print(e)
+            return None
+        return [row[0] for row in rows]
+
+    async def create_mailing(self, admin_chat_id, from_chat_id, message_id, total):
+        try:
+            return await self.pool.fetchrow(
+                """INSERT INTO mailings (admin_chat_id, from_chat_id, message_id, total, last_user_id)
+                VALUES ($1, $2, $3, $4, $5) RETURNING *""",
+                int(admin_chat_id), int(from_chat_id), int(message_id), total, MIN_USER_ID)
+        except DB_ERRORS as e:
+            print(e)
+            pass
+
+    async def get_running_mailings(self):
+        try:
+            return await self.pool.fetch("SELECT * FROM mailings WHERE status = 'running' ORDER BY id")
+        except DB_ERRORS as e:
+            print(e)
+            return []
+
+    async def save_mailing_progress(self, mailing_id, last_user_id, sent, failed, delivered, deactivated, deleted):
+        """Apply a batch of mailing results and move the checkpoint in one transaction.
+
+        Inactive users who received the message become active again; banned users are never reactivated.
+        """
         try:
-            with self.connect:
-                self.cursor.execute("SELECT file_id FROM downloaded_files WHERE url = %s", (url,))
-                return self.cursor.fetchall()
-        except psycopg2.OperationalError as e:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    activated = await self.set_status_many(delivered, "active", only_if=["inactive"], conn=conn)
+                    deactivated = await self.set_status_many(deactivated, "inactive", only_if=["active"], conn=conn)
+                    deleted = await self.delete_users_many(deleted, conn=conn)
+                    await conn.execute("UPDATE mailings SET last_user_id = $2, sent = $3, failed = $4 WHERE id = $1",
+                                       mailing_id, int(last_user_id), sent, failed)
+        except DB_ERRORS as e:
+            print(e)
+            return False
+
+        # Only now is the transaction committed, so the cache can follow it
+        for user_ids, status in ((activated, "active"), (deactivated, "inactive"), (deleted, None)):
+            for user_id in user_ids:
+                self.cache_status(user_id, status)
+        return True
+
+    async def finish_mailing(self, mailing_id):
+        try:
+            await self.pool.execute("UPDATE mailings SET status = 'done', finished_at = now() WHERE id = $1",
+                                    mailing_id)
+        except DB_ERRORS as e:
             print(e)
             pass
 
+    def file_id_cache_stats(self):
+        return {
+            'hits': self.file_id_cache_hits,
+            'misses': self.file_id_cache_misses,
+            'size': len(self.file_id_cache),
+        }
+
     async def get_downloaded_files_count(self, period: str):
+        periods = {
+            'Week': timedelta(weeks=1),
+            'Month': timedelta(days=30),
+            'Year': timedelta(days=365),
+        }
         try:
-            with self.connect:
-                if period == 'Week':
-                    start_date = datetime.now() - timedelta(weeks=1)
-                    query = """
-                    SELECT DATE(date_added) AS date, COUNT(*) 
-                    FROM downloaded_files 
-                    WHERE date_added >= %s 
-                    GROUP BY DATE(date_added)
-                    ORDER BY DATE(date_added)
-                    """
-                    self.cursor.execute(query, (start_date,))
-                elif period == 'Month':
-                    start_date = datetime.now() - timedelta(days=30)
-                    query = """
-                    SELECT DATE(date_added) AS date, COUNT(*) 
-                    FROM downloaded_files 
-                    WHERE date_added >= %s 
-                    GROUP BY DATE(date_added)
-                    ORDER BY DATE(date_added)
-                    """
-                    self.cursor.execute(query, (start_date,))
-                elif period == 'Year':
-                    start_date = datetime.now() - timedelta(days=365)
-                    query = """
-                    SELECT DATE(date_added) AS date, COUNT(*) 
-                    FROM downloaded_files 
-                    WHERE date_added >= %s 
-                    GROUP BY DATE(date_added)
-                    ORDER BY DATE(date_added)
-                    """
-                    self.cursor.execute(query, (start_date,))
-
-                result = self.cursor.fetchall()
-                # Перетворюємо результат у потрібний формат
-                return {row[0].strftime('%Y-%m-%d'): row[1] for row in result}
+            if period not in periods:
+                return {}
+
+            start_date = datetime.now(timezone.utc) - periods[period]
+            query = """
+            SELECT DATE(date_added) AS date, COUNT(*)
+            FROM downloaded_files
+            WHERE date_added >= $1
+            GROUP BY DATE(date_added)
+            ORDER BY DATE(date_added)
+            """
+            result = await self.pool.fetch(query, start_date)
+            # Перетворюємо результат у потрібний формат
+            return {row[0].strftime('%Y-%m-%d'): row[1] for row in result}
         except Exception as e:
             print("Error:", e)
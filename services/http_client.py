@@ -0,0 +1,82 @@
+import os
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+import config
+
+
+class FileTooLargeError(Exception):
+    pass
+
+
+class HttpClient:
+    """Shared aiohttp session for every outbound download.
+
+    One keep-alive connection pool is reused by all handlers. The connector caps total and per-host
+    connections, so one slow CDN can only hold its own slots instead of stalling the event loop.
+    """
+
+    def __init__(self, limit=config.HTTP_POOL_LIMIT, limit_per_host=config.HTTP_PER_HOST_LIMIT,
+                 chunk_size=config.HTTP_CHUNK_SIZE):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.chunk_size = chunk_size
+        self.timeout = aiohttp.ClientTimeout(total=config.HTTP_TIMEOUT,
+                                             sock_connect=config.HTTP_CONNECT_TIMEOUT,
+                                             sock_read=config.HTTP_READ_TIMEOUT)
+        self.session = None
+
+    def get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+                                             keepalive_timeout=30)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self.session
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    @asynccontextmanager
+    async def stream(self, url, headers=None, allow_redirects=True):
+        async with self.get_session().get(url, headers=headers, allow_redirects=allow_redirects) as response:
+            response.raise_for_status()
+            yield response
+
+    async def get_text(self, url, headers=None):
+        async with self.stream(url, headers=headers) as response:
+            return await response.text()
+
+    async def resolve(self, url, headers=None, method="HEAD"):
+        """Follow redirects and return the final URL."""
+        async with self.get_session().request(method, url, headers=headers, allow_redirects=True) as response:
+            return str(response.url)
+
+    async def save(self, response, path, max_size=None):
+        """Stream the body to disk one chunk at a time.
+
+        Peak memory is bounded by chunk_size. With max_size set, the download is aborted as soon as
+        Content-Length or the running byte count goes over it, and the partial file is removed.
+        """
+        if max_size is not None and response.content_length is not None and response.content_length > max_size:
+            raise FileTooLargeError(f"{response.url} is {response.content_length} bytes (limit {max_size})")
+
+        try:
+            written = 0
+            with open(path, "wb") as f:
+                async for chunk in response.content.iter_chunked(self.chunk_size):
+                    written += len(chunk)
+                    if max_size is not None and written > max_size:
+                        raise FileTooLargeError(f"{response.url} exceeded {max_size} bytes")
+                    f.write(chunk)
+        except BaseException:
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+
+    async def download(self, url, path, headers=None, max_size=None):
+        async with self.stream(url, headers=headers) as response:
+            await self.save(response, path, max_size=max_size)
+        return path
@@ -0,0 +1,122 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import instaloader
+
+import config
+
+
+class InstagramSessionManager:
+    """Pool of logged-in Instaloader instances shared by the Instagram handler.
+
+    The session is loaded (or logged in, with 2FA through two_factor_code) once. It is then copied into
+    every pooled instance, so concurrent requests each borrow their own context and never log in.
+    A background task borrows an idle instance, checks the session with test_login() and logs in again on
+    it only when it has expired; the other instances pick up the new session when they are next borrowed,
+    so an instance that is in use is never touched.
+    Blocking Instaloader calls go through run(), a bounded thread pool with a per-job timeout. A job that
+    times out keeps its thread, so its instance only goes back to the pool once that job has finished.
+    """
+
+    def __init__(self, login, password, two_factor_code, pool_size=config.INSTAGRAM_POOL_SIZE,
+                 check_interval=config.INSTAGRAM_SESSION_CHECK, timeout=config.INSTAGRAM_FETCH_TIMEOUT):
+        self.login = login
+        self.password = password
+        self.two_factor_code = two_factor_code
+        self.pool_size = pool_size
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="instagram")
+        self.loaders = [instaloader.Instaloader() for _ in range(pool_size)]
+        self.idle = asyncio.Queue()
+        self.lock = asyncio.Lock()
+        self.session = None
+        self.generation = 0
+        self.generations = {}
+        self.jobs = {}
+        self.started = False
+        self.check_task = None
+
+    async def sign_in(self, L, force=False):
+        """Sign L in from the saved session file, or with the password when force is set or there is none."""
+        if not force:
+            try:
+                # Спробувати завантажити сесію
+                await asyncio.to_thread(L.load_session_from_file, self.login)
+                print("Login with Session")
+            except Exception as e:
+                print(e)
+                force = True
+
+        if force:
+            try:
+                await asyncio.to_thread(L.close)
+                await asyncio.to_thread(L.login, self.login, self.password)
+                await asyncio.to_thread(L.save_session_to_file)
+                print("Login Successful")
+            except instaloader.exceptions.TwoFactorAuthRequiredException:
+                # Отримуємо код 2FA від адміністратора
+                code = str(await self.two_factor_code())
+                # Виконуємо двофакторний логін з кодом
+                await asyncio.to_thread(L.two_factor_login, code)
+                await asyncio.to_thread(L.save_session_to_file)
+
+        self.session = L.save_session()
+        self.generation += 1
+        self.generations[L] = self.generation
+
+    def sync(self, L):
+        """Copy the current session into L if it was signed in before the last login."""
+        if self.generations.get(L) != self.generation:
+            L.load_session(self.login, self.session)
+            self.generations[L] = self.generation
+
+    async def start(self):
+        async with self.lock:
+            if self.started:
+                return
+            await self.sign_in(self.loaders[0])
+            for loader in self.loaders:
+                self.idle.put_nowait(loader)
+            self.started = True
+            self.check_task = asyncio.create_task(self.check_session())
+
+    async def check_session(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            async with self.acquire() as L:
+                try:
+                    username = await self.run(L, L.test_login)
+                    if username is None:
+                        print("Instagram session expired, logging in again")
+                        # The session file holds the same expired cookies, so log in with the password
+                        await self.sign_in(L, force=True)
+                except Exception as e:
+                    print(f"Instagram session check failed: {e}")
+
+    async def run(self, L, func, *args):
+        """Run func(*args) for the borrowed instance L in the thread pool, giving up after timeout seconds."""
+        job = self.executor.submit(func, *args)
+        self.jobs[L] = job
+        return await asyncio.wait_for(asyncio.wrap_future(job), self.timeout)
+
+    def release(self, L):
+        job = self.jobs.pop(L, None)
+        if job is None or job.done():
+            self.idle.put_nowait(L)
+            return
+        # The job timed out but its thread is still using L: hand it back once the thread is done with it
+        loop = asyncio.get_running_loop()
+        job.add_done_callback(lambda _: loop.call_soon_threadsafe(self.idle.put_nowait, L))
+
+    @asynccontextmanager
+    async def acquire(self):
+        if not self.started:
+            await self.start()
+        L = await self.idle.get()
+        try:
+            self.sync(L)
+            yield L
+        finally:
+            self.release(L)
@@ -0,0 +1,49 @@
+import asyncio
+from collections import deque
+
+import config
+
+
+class KeyedWorkerPool:
+    """Runs jobs on a fixed set of worker tasks; jobs with the same key run one at a time, in order.
+
+    Only keys with pending jobs are tracked: a key's queue is dropped as soon as it is drained, so idle
+    chats cost nothing. A busy key goes to the back of the line after each job, so one chat with many
+    links cannot starve the others.
+    """
+
+    def __init__(self, handler, workers=config.TWITTER_CHAT_WORKERS):
+        self.handler = handler
+        self.workers = workers
+        self.queues = {}
+        self.ready = asyncio.Queue()
+        self.tasks = []
+
+    def submit(self, key, job):
+        if not self.tasks:
+            self.tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+
+        queue = self.queues.get(key)
+        if queue is None:
+            self.queues[key] = deque([job])
+            self.ready.put_nowait(key)
+        else:
+            queue.append(job)
+
+    async def worker(self):
+        while True:
+            key = await self.ready.get()
+            queue = self.queues[key]
+            job = queue.popleft()
+            try:
+                await self.handler(job)
+            except Exception as e:
+                print(f"Error processing job for {key}: {e}")
+
+            if queue:
+                self.ready.put_nowait(key)
+            else:
+                del self.queues[key]
+
+    def stats(self):
+        return {'keys': len(self.queues), 'jobs': sum(len(queue) for queue in self.queues.values())}
@@ -0,0 +1,54 @@
+import asyncio
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+import aiohttp
+from cachetools import TTLCache
+
+import config
+from services.single_flight import SingleFlight
+
+
+class LinkResolver:
+    """Expands share short links (vm.tiktok.com, t.co, ...) at most once per TTL.
+
+    Resolved targets are kept in memory and in the short_links table, so a link seen before a restart
+    is not followed again. Concurrent lookups of the same link share one request.
+    """
+
+    def __init__(self, http, db, ttl=config.SHORT_LINK_TTL, cache_size=config.SHORT_LINK_CACHE_SIZE):
+        self.http = http
+        self.db = db
+        self.ttl = timedelta(seconds=ttl)
+        self.cache = TTLCache(maxsize=cache_size, ttl=ttl)
+        self.inflight = SingleFlight()
+
+    @staticmethod
+    def cache_key(url):
+        parts = urlsplit(url)
+        return f"{parts.hostname}{parts.path.rstrip('/')}"
+
+    async def resolve(self, url, headers=None, method="HEAD"):
+        key = self.cache_key(url)
+
+        long_url = self.cache.get(key)
+        if long_url is not None:
+            return long_url
+
+        long_url, _ = await self.inflight.do(key, lambda: self.lookup(key, url, headers, method))
+        return long_url
+
+    async def lookup(self, key, url, headers, method):
+        long_url = await self.db.get_short_link(key, self.ttl)
+        if long_url is None:
+            try:
+                long_url = await self.http.resolve(url, headers=headers, method=method)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Error expanding URL: {e}")
+                return url
+            if long_url == url:
+                return url
+            await self.db.add_short_link(key, long_url)
+
+        self.cache[key] = long_url
+        return long_url
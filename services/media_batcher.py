@@ -0,0 +1,61 @@
+import asyncio
+
+import config
+
+
+class MediaBatcher:
+    """Collects media per key (e.g. chat and media kind) and sends them as albums of up to size items.
+
+    A batch is sent as soon as it is full, or max_wait seconds after its first item arrived, so a
+    partial album never waits for more links that may not come. Sends for one key are serialized to
+    keep albums in order. send(key, items) does the actual upload.
+    """
+
+    def __init__(self, send, size=config.ALBUM_SIZE, max_wait=config.ALBUM_MAX_WAIT):
+        self.send = send
+        self.size = min(size, 10)
+        self.max_wait = max_wait
+        self.batches = {}
+        self.timers = {}
+        self.locks = {}
+        self.pending = {}
+
+    async def add(self, key, item):
+        batch = self.batches.setdefault(key, [])
+        batch.append(item)
+        if len(batch) >= self.size:
+            await self.flush(key)
+        elif key not in self.timers:
+            self.timers[key] = asyncio.create_task(self.flush_later(key))
+
+    async def flush_later(self, key):
+        await asyncio.sleep(self.max_wait)
+        self.timers.pop(key, None)
+        await self.flush(key)
+
+    async def flush(self, key):
+        timer = self.timers.pop(key, None)
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+
+        items = self.batches.pop(key, [])
+        if not items:
+            return
+
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        self.pending[key] = self.pending.get(key, 0) + 1
+        try:
+            async with lock:
+                for i in range(0, len(items), self.size):
+                    try:
+                        await self.send(key, items[i:i + self.size])
+                    except Exception as e:
+                        print(f"Error sending album for {key}: {e}")
+        finally:
+            self.pending[key] -= 1
+            if not self.pending[key]:
+                del self.pending[key]
+                del self.locks[key]
+
+    async def flush_all(self):
+        await asyncio.gather(*(self.flush(key) for key in list(self.batches)))
@@ -0,0 +1,65 @@
+import asyncio
+from contextlib import nullcontext
+
+import config
+from services.http_client import FileTooLargeError
+
+
+async def fetch_in_chunks(items, fetch, chunk_size, workers=config.MEDIA_FETCH_WORKERS,
+                          retries=config.MEDIA_FETCH_RETRIES, slot=None):
+    """Run fetch(item) for all items concurrently and yield the results in item order, chunk_size at a time.
+
+    At most workers fetches run at once and each is retried up to retries times. Items that still fail
+    (or return None) are left out of their chunk. A chunk is yielded as soon as all of its items are
+    done, so the caller can upload it while later items keep downloading.
+    slot (e.g. DownloadScheduler.slot(...)) is held while the fetches run and released once the last
+    one finishes, not when the caller is done uploading; its errors (QueueFullError) are raised here.
+    Use it with contextlib.aclosing so pending fetches are cancelled if the consumer stops early.
+    """
+    semaphore = asyncio.Semaphore(workers)
+
+    async def run(item):
+        async with semaphore:
+            for attempt in range(1, retries + 1):
+                try:
+                    return await fetch(item)
+                except FileTooLargeError as e:
+                    print(e)
+                    return None
+                except Exception as e:
+                    print(f"Error fetching {item} (attempt {attempt}/{retries}): {e}")
+                    if attempt < retries:
+                        await asyncio.sleep(attempt)
+        return None
+
+    loop = asyncio.get_running_loop()
+    futures = [loop.create_future() for _ in items]
+
+    async def run_into(future, item):
+        result = await run(item)
+        if not future.done():
+            future.set_result(result)
+
+    async def produce():
+        try:
+            async with slot if slot is not None else nullcontext():
+                await asyncio.gather(*(run_into(future, item) for future, item in zip(futures, items)))
+        except asyncio.CancelledError:
+            for future in futures:
+                future.cancel()
+            raise
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+                    # Only the first pending chunk reports it; don't warn about the rest
+                    future.exception()
+
+    producer = asyncio.create_task(produce())
+    try:
+        for i in range(0, len(futures), chunk_size):
+            results = [result for result in await asyncio.gather(*futures[i:i + chunk_size]) if result is not None]
+            if results:
+                yield results
+    finally:
+        producer.cancel()
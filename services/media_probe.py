@@ -0,0 +1,134 @@
+import asyncio
+import json
+import os
+import struct
+import subprocess
+from typing import NamedTuple, Optional
+
+FFPROBE_TIMEOUT = 30
+
+# Containers that carry their own nested boxes on the way to tkhd
+CONTAINER_BOXES = {b"moov", b"trak"}
+
+
+class MediaInfo(NamedTuple):
+    width: Optional[int] = None
+    height: Optional[int] = None
+    duration_ms: Optional[int] = None
+
+    @property
+    def duration(self):
+        """Duration in whole seconds, as Telegram expects it."""
+        return round(self.duration_ms / 1000) if self.duration_ms is not None else None
+
+
+def iter_boxes(f, start, end):
+    """Yield (type, payload_offset, payload_size) for every box between start and end without reading payloads."""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            return
+        yield box_type, offset + header_size, size - header_size
+        offset += size
+
+
+def parse_mvhd(data):
+    version = data[0]
+    if version == 1:
+        timescale, duration = struct.unpack(">IQ", data[20:32])
+    else:
+        timescale, duration = struct.unpack(">II", data[12:20])
+    return round(duration * 1000 / timescale) if timescale else None
+
+
+def parse_tkhd(data):
+    version = data[0]
+    # Skip version/flags, timestamps, track id and duration to reach the matrix
+    body = data[4 + (32 if version == 1 else 20):]
+    matrix = struct.unpack(">9i", body[16:52])
+    width, height = struct.unpack(">II", body[52:60])
+    width, height = width >> 16, height >> 16
+    # A 90/270 degree rotation matrix (a == 0) means the player shows the frame sideways
+    if matrix[0] == 0 and matrix[1] != 0:
+        width, height = height, width
+    return width, height
+
+
+def probe_mp4(path):
+    width = height = duration_ms = None
+    with open(path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        pending = [(0, file_size)]
+        while pending:
+            start, end = pending.pop()
+            for box_type, offset, size in iter_boxes(f, start, end):
+                if box_type in CONTAINER_BOXES:
+                    pending.append((offset, offset + size))
+                elif box_type == b"mvhd":
+                    f.seek(offset)
+                    duration_ms = parse_mvhd(f.read(min(size, 32)))
+                elif box_type == b"tkhd" and not width:
+                    f.seek(offset)
+                    data = f.read(min(size, 96))
+                    track_width, track_height = parse_tkhd(data)
+                    if track_width and track_height:
+                        width, height = track_width, track_height
+    if duration_ms is None:
+        return None
+    return MediaInfo(width, height, duration_ms)
+
+
+def probe_ffprobe(path):
+    cmd = [
+        'ffprobe', '-v', 'error', '-print_format', 'json',
+        '-show_entries', 'stream=width,height:format=duration',
+        path
+    ]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=FFPROBE_TIMEOUT,
+                            check=True)
+    data = json.loads(result.stdout)
+
+    width = height = None
+    for stream in data.get("streams", []):
+        if stream.get("width") and stream.get("height"):
+            width, height = stream["width"], stream["height"]
+            break
+
+    duration = data.get("format", {}).get("duration")
+    duration_ms = round(float(duration) * 1000) if duration else None
+    return MediaInfo(width, height, duration_ms)
+
+
+def probe(path):
+    """Read width, height and duration from the container header without decoding any frames.
+
+    MP4/M4A files are parsed directly from their moov boxes. Anything else, or an MP4 we cannot make
+    sense of, falls back to a single ffprobe call. Fields that cannot be determined are None.
+    """
+    try:
+        info = probe_mp4(path)
+        if info is not None:
+            return info
+    except (OSError, struct.error, IndexError) as e:
+        print(f"MP4 probe failed for {path}: {e}")
+
+    try:
+        return probe_ffprobe(path)
+    except (OSError, ValueError, subprocess.SubprocessError) as e:
+        print(f"ffprobe failed for {path}: {e}")
+        return MediaInfo()
+
+
+async def probe_media(path):
+    return await asyncio.to_thread(probe, path)
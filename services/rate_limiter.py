@@ -0,0 +1,66 @@
+import asyncio
+import time
+
+from cachetools import TTLCache
+
+import config
+
+
+class TokenBucket:
+    """Allows rate tokens per second on average, with bursts of up to capacity.
+
+    An acquisition of more tokens than capacity waits for a full bucket and leaves it in debt, so the
+    sends after it are held back until the surplus has been paid off.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens=1):
+        needed = min(tokens, self.capacity)
+        async with self.lock:
+            self.refill()
+            while self.tokens < needed:
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= tokens
+
+
+class ChatRateLimiter:
+    """Paces outgoing messages to Telegram's documented limits.
+
+    Every send takes tokens (one per message, so a media group takes one per item) from its chat's
+    bucket (chat_rate per second in private chats, group_rate per minute with bursts of up to group_rate
+    in groups and channels, whose ids are negative) and then from the bot-wide global bucket.
+    Buckets of chats that have been quiet for idle_ttl seconds are dropped.
+    """
+
+    def __init__(self, global_rate=config.TELEGRAM_GLOBAL_RATE, chat_rate=config.TELEGRAM_CHAT_RATE,
+                 group_rate=config.TELEGRAM_GROUP_RATE, idle_ttl=60, max_chats=100_000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.buckets = TTLCache(maxsize=max_chats, ttl=idle_ttl)
+
+    def bucket(self, chat_id):
+        bucket = self.buckets.get(chat_id)
+        if bucket is None:
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = TokenBucket(self.group_rate / 60, self.group_rate) if is_group else TokenBucket(self.chat_rate)
+        # Re-inserting on every use keeps an active chat's bucket alive past idle_ttl
+        self.buckets[chat_id] = bucket
+        return bucket
+
+    async def acquire(self, chat_id=None, tokens=1):
+        if chat_id is not None:
+            await self.bucket(chat_id).acquire(tokens)
+        await self.global_bucket.acquire(tokens)
@@ -0,0 +1,79 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import messages as bm
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class DownloadScheduler:
+    """Caps how many downloads run at once, per platform and overall.
+
+    Each platform has its own worker pool; a job must hold a slot in its platform pool and in the global
+    pool before it starts. Jobs beyond max_queue waiting per platform are rejected up front, so a burst of
+    links queues up (and tells the user where they are) instead of saturating bandwidth and disk.
+    """
+
+    def __init__(self, limits, global_limit, max_queue):
+        self.global_slots = asyncio.Semaphore(global_limit)
+        self.pools = {platform: asyncio.Semaphore(limit) for platform, limit in limits.items()}
+        self.max_queue = max_queue
+        self.waiting = {platform: 0 for platform in limits}
+        self.running = {platform: 0 for platform in limits}
+
+    def is_busy(self, platform):
+        return self.pools[platform].locked() or self.global_slots.locked()
+
+    @asynccontextmanager
+    async def slot(self, platform, message=None):
+        if self.waiting[platform] >= self.max_queue:
+            raise QueueFullError(f"{platform} queue is full ({self.max_queue} waiting)")
+
+        # Counted before the reply is awaited, so a burst can't slip past max_queue
+        self.waiting[platform] += 1
+        status_message = None
+        acquired = False
+        try:
+            if message is not None and self.is_busy(platform):
+                try:
+                    status_message = await message.reply(bm.queued(self.waiting[platform]))
+                except Exception as e:
+                    print(f"Error sending queue position: {e}")
+
+            await self.pools[platform].acquire()
+            try:
+                await self.global_slots.acquire()
+            except BaseException:
+                self.pools[platform].release()
+                raise
+            acquired = True
+            self.waiting[platform] -= 1
+            self.running[platform] += 1
+
+            if status_message is not None:
+                await self.delete_status(status_message)
+                status_message = None
+            yield
+        finally:
+            if acquired:
+                self.running[platform] -= 1
+                self.global_slots.release()
+                self.pools[platform].release()
+            else:
+                self.waiting[platform] -= 1
+            # Still set only if the wait was cancelled or failed before the slot was taken
+            if status_message is not None:
+                await self.delete_status(status_message)
+
+    @staticmethod
+    async def delete_status(status_message):
+        try:
+            await status_message.delete()
+        except Exception as e:
+            print(f"Error deleting queue position: {e}")
+
+    def stats(self):
+        return {platform: {'running': self.running[platform], 'waiting': self.waiting[platform]}
+                for platform in self.pools}
@@ -0,0 +1,35 @@
+import asyncio
+
+
+class SingleFlight:
+    """Runs one job per key; concurrent callers with the same key wait for that job instead of repeating it."""
+
+    def __init__(self):
+        self.calls = {}
+
+    async def do(self, key, func):
+        """Return (result, shared); shared is True when the result came from another caller's job."""
+        future = self.calls.get(key)
+        if future is not None:
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        self.calls[key] = future
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved so a job without followers does not log a warning
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            self.calls.pop(key, None)
+
+    def in_flight(self, key):
+        return key in self.calls
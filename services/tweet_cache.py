@@ -0,0 +1,40 @@
+import json
+from datetime import timedelta
+
+from cachetools import TTLCache
+
+import config
+from services.single_flight import SingleFlight
+
+
+class TweetCache:
+    """Scraped tweet JSON, kept in memory and in the tweets table for ttl seconds.
+
+    scrape(tweet_id) is only called on a miss; concurrent lookups of the same tweet share one scrape.
+    """
+
+    def __init__(self, db, scrape, ttl=config.TWEET_CACHE_TTL, cache_size=config.TWEET_CACHE_SIZE):
+        self.db = db
+        self.scrape = scrape
+        self.ttl = timedelta(seconds=ttl)
+        self.cache = TTLCache(maxsize=cache_size, ttl=ttl)
+        self.inflight = SingleFlight()
+
+    async def get(self, tweet_id):
+        tweet = self.cache.get(tweet_id)
+        if tweet is not None:
+            return tweet
+
+        tweet, _ = await self.inflight.do(tweet_id, lambda: self.lookup(tweet_id))
+        return tweet
+
+    async def lookup(self, tweet_id):
+        data = await self.db.get_tweet(tweet_id, self.ttl)
+        if data is not None:
+            tweet = json.loads(data)
+        else:
+            tweet = await self.scrape(tweet_id)
+            await self.db.add_tweet(tweet_id, json.dumps(tweet))
+
+        self.cache[tweet_id] = tweet
+        return tweet
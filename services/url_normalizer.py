@@ -0,0 +1,85 @@
+import re
+from urllib.parse import urlsplit, parse_qs
+
+# Share links that only redirect to the real URL and carry no content id themselves
+SHORT_LINK_HOSTS = {"vm.tiktok.com", "vt.tiktok.com", "vn.tiktok.com", "t.co"}
+
+TIKTOK_ID = re.compile(r"/(video|photo)/(\d+)")
+YOUTUBE_PATH_ID = re.compile(r"^/(?:shorts|embed|live|v)/([\w-]{11})")
+INSTAGRAM_SHORTCODE = re.compile(r"^/(?:[\w.]+/)?(?:p|reel|reels|tv)/([\w-]+)")
+TWEET_ID = re.compile(r"^/(?:[\w]{1,15}|i)/(?:web/)?status(?:es)?/(\d{1,20})")
+
+
+def host_of(url):
+    host = urlsplit(url).hostname or ""
+    return host[4:] if host.startswith("www.") else host
+
+
+def is_short_link(url):
+    host = host_of(url)
+    return host in SHORT_LINK_HOSTS or (host == "tiktok.com" and urlsplit(url).path.startswith("/t/"))
+
+
+def tiktok_id(url):
+    match = TIKTOK_ID.search(urlsplit(url).path)
+    return match.group(2) if match else None
+
+
+def youtube_id(url):
+    parts = urlsplit(url)
+    host = host_of(url)
+    if host == "youtu.be":
+        video_id = parts.path.lstrip("/").split("/")[0]
+        return video_id or None
+    if host.endswith("youtube.com") or host.endswith("youtube-nocookie.com"):
+        video_id = parse_qs(parts.query).get("v", [None])[0]
+        if video_id:
+            return video_id
+        match = YOUTUBE_PATH_ID.match(parts.path)
+        return match.group(1) if match else None
+    return None
+
+
+def instagram_shortcode(url):
+    match = INSTAGRAM_SHORTCODE.match(urlsplit(url).path)
+    return match.group(1) if match else None
+
+
+def tweet_id(url):
+    if host_of(url) not in ("twitter.com", "x.com", "mobile.twitter.com", "mobile.x.com"):
+        return None
+    match = TWEET_ID.match(urlsplit(url).path)
+    return match.group(1) if match else None
+
+
+CONTENT_ID_EXTRACTORS = {
+    'tiktok': tiktok_id,
+    'youtube': youtube_id,
+    'instagram': instagram_shortcode,
+    'twitter': tweet_id,
+}
+
+# Canonical forms double as downloaded_files keys. YouTube and Instagram keep the shape the handlers
+# already stored (pytubefix watch_url, reel prefix + shortcode) so existing rows stay valid.
+CANONICAL_FORMATS = {
+    'tiktok': "https://www.tiktok.com/video/{}",
+    'youtube': "https://youtube.com/watch?v={}",
+    'instagram': "https://www.instagram.com/reel/{}",
+    'twitter': "https://x.com/i/status/{}",
+}
+
+
+def extract_content_id(platform, url):
+    return CONTENT_ID_EXTRACTORS[platform](url)
+
+
+def canonical_url(platform, url):
+    """Map every share variant of a post to one cache key, or None when no content id can be found.
+
+    Short links have to be resolved first; query strings, tracking params, mobile hosts and
+    alternative paths (youtu.be, /shorts/, /p/ vs /reel/, x.com vs twitter.com) all collapse to the id.
+    """
+    content_id = extract_content_id(platform, url)
+    if content_id is None:
+        return None
+    return CANONICAL_FORMATS[platform].format(content_id)
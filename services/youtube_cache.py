@@ -0,0 +1,41 @@
+import asyncio
+
+from cachetools import TTLCache
+from pytubefix import YouTube
+
+import config
+from services.single_flight import SingleFlight
+from services.url_normalizer import youtube_id
+
+
+class YouTubeCache:
+    """Memoizes pytubefix YouTube objects per video id, with the watch page and stream manifest already loaded.
+
+    Building one costs several blocking requests to YouTube, so it happens once per ttl in a worker
+    thread, and concurrent requests for the same video share the same build. The ttl stays well under
+    the lifetime of YouTube's signed stream URLs.
+    """
+
+    def __init__(self, ttl=config.YOUTUBE_CACHE_TTL, size=config.YOUTUBE_CACHE_SIZE):
+        self.cache = TTLCache(maxsize=size, ttl=ttl)
+        self.inflight = SingleFlight()
+
+    def peek(self, url):
+        return self.cache.get(youtube_id(url) or url)
+
+    async def get(self, url, **kwargs):
+        key = youtube_id(url) or url
+
+        yt = self.cache.get(key)
+        if yt is None:
+            yt, _ = await self.inflight.do(key, lambda: asyncio.to_thread(self.load, url, kwargs))
+            self.cache[key] = yt
+        return yt
+
+    @staticmethod
+    def load(url, kwargs):
+        yt = YouTube(url, **kwargs)
+        # Touch the lazy properties here so the page and player are fetched off the event loop
+        yt.streams
+        yt.title
+        return yt
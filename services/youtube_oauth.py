@@ -0,0 +1,142 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from urllib.error import HTTPError
+
+from pytubefix import request
+from pytubefix.innertube import InnerTube, _client_id, _client_secret
+
+import config
+
+
+class OAuthPendingError(Exception):
+    pass
+
+
+class YouTubeOAuthManager:
+    """Keeps the pytubefix OAuth token cached on disk and fresh, off the download path.
+
+    Downloads only use OAuth once token_file holds a token; until then, and while a rejected token is
+    being renewed, they run anonymously while the device flow runs in its own thread, with the
+    verification code sent to the admin through the bot. The flow polls Google until the admin enters the
+    code, and the old token file is only replaced once a new token has been written.
+    A background task refreshes the access token before it expires, so YouTube() never has to.
+    """
+
+    def __init__(self, bot, admin_id, token_file=config.YOUTUBE_TOKEN_FILE,
+                 refresh_interval=config.YOUTUBE_TOKEN_REFRESH):
+        self.bot = bot
+        self.admin_id = admin_id
+        self.token_file = token_file
+        self.refresh_interval = refresh_interval
+        self.loop = None
+        self.refresh_task = None
+        self.authorize_thread = None
+
+    def is_authorizing(self):
+        return self.authorize_thread is not None and self.authorize_thread.is_alive()
+
+    def is_ready(self):
+        return os.path.exists(self.token_file) and not self.is_authorizing()
+
+    def start(self):
+        if self.refresh_task is None:
+            self.loop = asyncio.get_running_loop()
+            self.refresh_task = self.loop.create_task(self.refresh_loop())
+
+    def youtube_kwargs(self):
+        """Keyword arguments for YouTube(): OAuth when a token is cached, anonymous (and start the device flow) otherwise."""
+        self.start()
+        if not self.is_ready():
+            self.authorize()
+            return {}
+        return {'use_oauth': True, 'allow_oauth_cache': True, 'token_file': self.token_file,
+                'oauth_verifier': self.verifier}
+
+    def verifier(self, verification_url, user_code):
+        # A cached token was rejected: start over in the background rather than block this download
+        self.authorize()
+        raise OAuthPendingError("YouTube OAuth token is being renewed")
+
+    def authorize(self):
+        if self.is_authorizing():
+            return
+        self.authorize_thread = threading.Thread(target=self.device_flow, name="youtube-oauth", daemon=True)
+        self.authorize_thread.start()
+
+    def device_flow(self):
+        try:
+            self.save_tokens(self.fetch_tokens())
+            print("YouTube OAuth token saved")
+        except Exception as e:
+            print(f"YouTube OAuth failed: {e}")
+
+    def fetch_tokens(self):
+        """Run the OAuth device flow, polling the token endpoint until the admin enters the code."""
+        start_time = int(time.time() - 30)
+        response = request._execute_request('https://oauth2.googleapis.com/device/code', 'POST',
+                                            headers={'Content-Type': 'application/json'},
+                                            data={'client_id': _client_id,
+                                                  'scope': 'https://www.googleapis.com/auth/youtube'})
+        device = json.loads(response.read())
+        self.notify_admin(device['verification_url'], device['user_code'])
+
+        data = {'client_id': _client_id, 'client_secret': _client_secret, 'device_code': device['device_code'],
+                'grant_type': 'urn:ietf:params:oauth:grant-type:device_code'}
+        interval = device.get('interval', 5)
+        deadline = time.monotonic() + device['expires_in']
+        while time.monotonic() < deadline:
+            time.sleep(interval)
+            try:
+                response = request._execute_request('https://oauth2.googleapis.com/token', 'POST',
+                                                    headers={'Content-Type': 'application/json'}, data=data)
+            except HTTPError as e:
+                error = json.loads(e.read() or b'{}').get('error')
+                if error == 'authorization_pending':
+                    continue
+                if error == 'slow_down':
+                    interval += 5
+                    continue
+                raise Exception(f"token request failed: {error or e}")
+
+            tokens = json.loads(response.read())
+            return {'access_token': tokens['access_token'], 'refresh_token': tokens['refresh_token'],
+                    'expires': start_time + tokens['expires_in'], 'visitorData': None, 'po_token': None}
+
+        raise Exception("the verification code expired before it was entered")
+
+    def save_tokens(self, tokens):
+        # Same format as InnerTube.cache_tokens(); written aside and renamed so the old token stays usable
+        # until the new one is complete
+        directory = os.path.dirname(os.path.abspath(self.token_file))
+        os.makedirs(directory, exist_ok=True)
+        temp_file = f"{self.token_file}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(tokens, f)
+        os.replace(temp_file, self.token_file)
+
+    def notify_admin(self, verification_url, user_code):
+        text = (f"<b>OAuth Verification</b>\n\nOpen this URL in your browser:\n{verification_url}\n\n"
+                f"Enter this code:\n<code>{user_code}</code>")
+        future = asyncio.run_coroutine_threadsafe(
+            self.bot.send_message(self.admin_id, text, parse_mode="HTML"), self.loop)
+        try:
+            future.result(timeout=30)
+        except Exception as e:
+            print(f"Failed to send OAuth code to admin: {e}")
+
+    def refresh(self):
+        innertube = InnerTube(client='TV', use_oauth=True, allow_cache=True, token_file=self.token_file)
+        if innertube.access_token:
+            innertube.refresh_bearer_token(force=innertube.expires - time.time() < self.refresh_interval)
+
+    async def refresh_loop(self):
+        while True:
+            if self.is_ready():
+                try:
+                    await asyncio.to_thread(self.refresh)
+                except Exception as e:
+                    print(f"YouTube OAuth refresh failed: {e}")
+            await asyncio.sleep(self.refresh_interval)
@@ -0,0 +1,85 @@
+import asyncio
+import os
+
+
+def resolution_of(stream):
+    try:
+        return int((stream.resolution or "0").rstrip("p"))
+    except ValueError:
+        return 0
+
+
+def size_of(stream):
+    try:
+        return stream.filesize
+    except Exception as e:
+        print(f"Error reading size of itag {stream.itag}: {e}")
+        return None
+
+
+def select_streams(streams, max_bytes):
+    """Pick the best (video, audio) pair whose advertised sizes fit in max_bytes.
+
+    Adaptive mp4 video (H.264 preferred over AV1 at the same resolution) is paired with the best AAC
+    audio track that still fits. When no adaptive pair fits, the best progressive mp4 that does is
+    returned as (stream, None). Returns (None, None) when nothing fits.
+    """
+    audios = sorted(streams.filter(only_audio=True, file_extension='mp4'), key=lambda s: s.bitrate or 0, reverse=True)
+    videos = sorted(streams.filter(only_video=True, adaptive=True, file_extension='mp4'),
+                    key=lambda s: (resolution_of(s), (s.video_codec or "").startswith("avc1")), reverse=True)
+
+    audio_sizes = [(audio, size_of(audio)) for audio in audios]
+    audio_sizes = [(audio, size) for audio, size in audio_sizes if size]
+
+    for video in videos:
+        video_size = size_of(video)
+        if not video_size:
+            continue
+        for audio, audio_size in audio_sizes:
+            if video_size + audio_size <= max_bytes:
+                return video, audio
+
+    progressive = sorted(streams.filter(progressive=True, file_extension='mp4'), key=resolution_of, reverse=True)
+    for stream in progressive:
+        size = size_of(stream)
+        if size and size <= max_bytes:
+            return stream, None
+
+    return None, None
+
+
+async def mux(video_path, audio_path, output_path):
+    """Remux a video-only and an audio-only track into one mp4 without re-encoding."""
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-i", video_path, "-i", audio_path,
+        "-map", "0:v:0", "-map", "1:a:0", "-c", "copy", "-movflags", "+faststart",
+        output_path,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+    _, stderr = await process.communicate()
+    if process.returncode != 0:
+        raise Exception(f"ffmpeg failed: {stderr.decode(errors='replace').strip()}")
+
+
+async def download_streams(video, audio, output_dir, filename):
+    """Download the selected streams into output_dir/filename, muxing them when they are separate tracks."""
+    if audio is None:
+        await asyncio.to_thread(video.download, output_path=output_dir, filename=filename)
+        return os.path.join(output_dir, filename)
+
+    base, _ = os.path.splitext(filename)
+    video_name, audio_name = f"{base}.video.mp4", f"{base}.audio.m4a"
+
+    # Both tracks come from googlevideo; fetching them side by side halves the wait
+    await asyncio.gather(
+        asyncio.to_thread(video.download, output_path=output_dir, filename=video_name),
+        asyncio.to_thread(audio.download, output_path=output_dir, filename=audio_name))
+
+    video_path, audio_path = os.path.join(output_dir, video_name), os.path.join(output_dir, audio_name)
+    try:
+        await mux(video_path, audio_path, os.path.join(output_dir, filename))
+    finally:
+        for path in (video_path, audio_path):
+            if os.path.exists(path):
+                os.remove(path)
+    return os.path.join(output_dir, filename)